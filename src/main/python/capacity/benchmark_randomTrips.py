@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of randomTrips on synthetic networks, which does not need a real network or SUMO binaries """
+
+import csv
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+CASES = ("construct", "sample", "batch", "distance", "write")
+
+CASE_HELP = """construct: building the trip generator (edge table and source, sink and via generators)
+sample: drawing trips one by one (the default mode of randomTrips)
+batch: drawing trips in batches of candidates (--batch-size 10000)
+distance: batch drawing with minimum and maximum distance of a quarter and half the network diameter
+write: complete run of randomTrips.main with batch drawing, writing the trip file without routing"""
+
+
+def write_net(f_name, nodes, links, speed=13.89, speeds=None):
+    """ Write a SUMO network with one lane per edge and connections to all outgoing edges except the u-turn,
+     speeds optionally overrides the speed of single links """
+
+    incoming = {n: [] for n in nodes}
+    outgoing = {n: [] for n in nodes}
+    for u, v in links:
+        incoming[v].append((u, v))
+        outgoing[u].append((u, v))
+
+    xs = [x for x, _ in nodes.values()]
+    ys = [y for _, y in nodes.values()]
+    boundary = "%.2f,%.2f,%.2f,%.2f" % (min(xs), min(ys), max(xs), max(ys))
+
+    with open(f_name, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<net version="1.16" junctionCornerDetail="5" limitTurnSpeed="5.50">\n')
+        f.write('    <location netOffset="0.00,0.00" convBoundary="%s" origBoundary="%s" projParameter="!"/>\n'
+                % (boundary, boundary))
+
+        for u, v in links:
+            (x1, y1), (x2, y2) = nodes[u], nodes[v]
+            length = max(0.1, math.hypot(x2 - x1, y2 - y1))
+            f.write('    <edge id="%s_%s" from="%s" to="%s" priority="1" type="highway.primary">\n' % (u, v, u, v))
+            f.write('        <lane id="%s_%s_0" index="0" speed="%.2f" length="%.2f" shape="%.2f,%.2f %.2f,%.2f"/>\n'
+                    % (u, v, (speeds or {}).get((u, v), speed), length, x1, y1, x2, y2))
+            f.write('    </edge>\n')
+
+        for n, (x, y) in nodes.items():
+            inc = " ".join("%s_%s_0" % e for e in incoming[n])
+            f.write('    <junction id="%s" type="%s" x="%.2f" y="%.2f" incLanes="%s" intLanes="" shape="%.2f,%.2f"/>\n'
+                    % (n, "priority" if len(incoming[n]) > 1 else "dead_end", x, y, inc, x, y))
+
+        for u, v in links:
+            for _, w in outgoing[v]:
+                if w != u:
+                    f.write('    <connection from="%s_%s" to="%s_%s" fromLane="0" toLane="0" dir="s" state="M"/>\n'
+                            % (u, v, v, w))
+
+        f.write('</net>\n')
+
+
+def grid_net(f_name, size, length=200.):
+    """ Grid of size x size junctions with edges in both directions """
+
+    nodes = {"%d/%d" % (i, j): (i * length, j * length) for i in range(size) for j in range(size)}
+    links = []
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size:
+                links += [("%d/%d" % (i, j), "%d/%d" % (i + 1, j)), ("%d/%d" % (i + 1, j), "%d/%d" % (i, j))]
+            if j + 1 < size:
+                links += [("%d/%d" % (i, j), "%d/%d" % (i, j + 1)), ("%d/%d" % (i, j + 1), "%d/%d" % (i, j))]
+
+    write_net(f_name, nodes, links)
+
+
+def radial_net(f_name, size, length=200.):
+    """ Spider net with size rings and 2 * size spokes around a center junction """
+
+    spokes = 2 * size
+    nodes = {"c": (0., 0.)}
+    links = []
+    for r in range(1, size + 1):
+        for s in range(spokes):
+            angle = 2 * math.pi * s / spokes
+            nodes["%d/%d" % (r, s)] = (r * length * math.cos(angle), r * length * math.sin(angle))
+            inner = "c" if r == 1 else "%d/%d" % (r - 1, s)
+            links += [(inner, "%d/%d" % (r, s)), ("%d/%d" % (r, s), inner)]
+            nxt = "%d/%d" % (r, (s + 1) % spokes)
+            links += [("%d/%d" % (r, s), nxt), (nxt, "%d/%d" % (r, s))]
+
+    write_net(f_name, nodes, links)
+
+
+def run_case(case, net_file, trips, seed):
+    """ Run a single case and return the measured time (executed in its own process) """
+
+    from randomTrips import get_options, init_generation, sample_trips, main
+
+    end = 3600
+    args = ["-n", net_file, "-b", "0", "-e", str(end), "-p", repr(end / trips), "--seed", str(seed)]
+
+    if case in ("batch", "distance", "write"):
+        args += ["--batch-size", "10000"]
+
+    net = None
+    if case == "distance":
+        import sumolib
+        net = sumolib.net.readNet(net_file)
+        diameter = net.getBBoxDiameter()
+        args += ["--min-distance", str(diameter / 4), "--max-distance", str(diameter / 2)]
+
+    out = None
+    if case == "write":
+        fd, out = tempfile.mkstemp(suffix=".trips.xml")
+        os.close(fd)
+        args += ["-o", out]
+
+    options = get_options(args, net)
+
+    n = 0
+    start = time.perf_counter()
+
+    if case == "write":
+        main(options)
+        with open(out) as f:
+            n = sum(1 for line in f if line.startswith("    <trip "))
+        os.remove(out)
+        elapsed = time.perf_counter() - start
+    else:
+        generator = init_generation(options)
+        elapsed = time.perf_counter() - start
+        if case != "construct":
+            start = time.perf_counter()
+            for _ in sample_trips(options, generator):
+                n += 1
+            elapsed = time.perf_counter() - start
+
+    # ru_maxrss is given in kilobytes on linux
+    return {"seconds": elapsed, "trips": n, "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def benchmark(args):
+    """ Run all combinations of network, case and number of trips, each in a fresh process """
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for network in args.network:
+            net_file = os.path.join(tmp, "%s.net.xml" % network)
+            (grid_net if network == "grid" else radial_net)(net_file, args.size)
+
+            with open(net_file) as f:
+                edges = sum(1 for line in f if line.startswith("    <edge "))
+
+            for case in args.case:
+                for trips in (args.trips[:1] if case == "construct" else args.trips):
+                    with ctx.Pool(1) as pool:
+                        res = pool.apply(run_case, (case, net_file, trips, args.seed))
+
+                    res.update(network=network, edges=edges, case=case,
+                               trips_per_s=res["trips"] / res["seconds"] if res["trips"] else float("nan"))
+                    results.append(res)
+
+                    print("%-7s %7d edges  %-9s %9d trips  %8.2f s  %12.0f trips/s  %8.1f MB" % (
+                        network, edges, case, res["trips"], res["seconds"], res["trips_per_s"], res["peak_mb"]))
+                    sys.stdout.flush()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark trip generation of randomTrips on synthetic networks",
+                            epilog=CASE_HELP)
+
+    parser.add_argument("--network", nargs="+", default=["grid", "radial"], choices=["grid", "radial"],
+                        help="Synthetic network types")
+    parser.add_argument("--size", type=int, default=50,
+                        help="Number of junctions per side of the grid, or number of rings of the radial network")
+    parser.add_argument("--trips", nargs="+", type=int, default=[10000, 100000, 1000000],
+                        help="Number of trips to generate")
+    parser.add_argument("--case", nargs="+", default=list(CASES), choices=CASES, help="Cases to run")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", help="Write the results as csv to this file")
+
+    args = parser.parse_args()
+
+    results = benchmark(args)
+
+    if args.output:
+        columns = ["network", "edges", "case", "trips", "seconds", "trips_per_s", "peak_mb"]
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
@@ -9,6 +9,8 @@ import lxml.etree as ET
 import pandas as pd
 from shapely.geometry import LineString
 
+from utils import Manifest
+
 
 def build_datasets(network, inter, routes):
     """ Build all datasets needed for training models"""
@@ -238,7 +240,7 @@ def read_edges(folder):
 
     data = []
     for f in os.listdir(folder):
-        if not f.endswith(".csv"):
+        if not f.endswith(".csv") or Manifest.is_manifest(os.path.join(folder, f)):
             continue
 
         df = pd.read_csv(os.path.join(folder, f))
@@ -259,7 +261,7 @@ def read_intersections(folder):
 
     data = []
     for f in os.listdir(folder):
-        if not f.endswith(".csv"):
+        if not f.endswith(".csv") or Manifest.is_manifest(os.path.join(folder, f)):
             continue
 
         try:
@@ -282,7 +284,7 @@ def read_routes(folder):
     """ Read routes from folder """
     data = []
     for f in os.listdir(folder):
-        if not f.endswith(".csv"):
+        if not f.endswith(".csv") or Manifest.is_manifest(os.path.join(folder, f)):
             continue
 
         try:
@@ -23,16 +23,34 @@ from __future__ import absolute_import
 import os
 import sys
 import random
-import bisect
+import contextlib
+import copy
+import csv
+import gc
+import gzip
+import hashlib
+import itertools
+import json
+import pickle
+import re
 import subprocess
-from collections import defaultdict
+from time import perf_counter, process_time
+from collections import Counter, defaultdict, namedtuple
 import math
+import multiprocessing
+import shutil
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
 
 if 'SUMO_HOME' in os.environ:
     sys.path.append(os.path.join(os.environ['SUMO_HOME'], 'tools'))
 import sumolib  # noqa
 from sumolib.miscutils import euclidean, parseTime, intIfPossible  # noqa
-from sumolib.geomhelper import naviDegree, minAngleDegreeDiff  # noqa
+from sumolib.geomhelper import naviDegree  # noqa
 from sumolib.net.lane import is_vehicle_class  # noqa
 
 DUAROUTER = sumolib.checkBinary('duarouter')
@@ -40,31 +58,75 @@ DUAROUTER = sumolib.checkBinary('duarouter')
 SOURCE_SUFFIX = ".src.xml"
 DEST_SUFFIX = ".dst.xml"
 VIA_SUFFIX = ".via.xml"
+# weight files may also be stored in these binary formats instead of xml
+WEIGHT_FORMATS = ("xml", "npz", "parquet")
+NET_CACHE_SUFFIX = ".cache.pkl"
+WEIGHTS_CACHE_SUFFIX = ".cache.npz"
+STOPS_CACHE_SUFFIX = ".stops.npz"
+
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# fringe classification bits of an edge as computed by fringe_flags
+FRINGE_INCOMING = 1
+FRINGE_OUTGOING = 2
+FRINGE_JUNCTION_INCOMING = 4
+FRINGE_JUNCTION_OUTGOING = 8
+FRINGE_ANY = FRINGE_INCOMING | FRINGE_OUTGOING
 
 MAXIMIZE_FACTOR = "max"
 
 
-def get_options(args=None):
+def get_options(args=None, net=None):
+    """parses the options; if net is given it is used instead of loading the net file, which becomes optional"""
     op = sumolib.options.ArgumentParser(description="Generate trips between random locations",
                                         allowed_programs=['duarouter'])
     # input
-    op.add_argument("-n", "--net-file", category="input", dest="netfile", required=True, type=op.net_file,
+    op.add_argument("-n", "--net-file", category="input", dest="netfile", required=net is None, type=op.net_file,
                     help="define the net file (mandatory)")
+    op.add_argument("--net-cache", category="input", dest="netCache", action="store_true", default=False,
+                    help="store the parsed network in a binary file next to the net file and reuse it " +
+                    "as long as the content of the net file and the sumolib version do not change. Loading from " +
+                    "the cache is about 2-3 times faster than parsing, writing it takes about twice as long")
     op.add_argument("-a", "--additional-files", category="input", dest="additional", type=op.additional_file,
                     help="define additional files to be loaded by the router")
     op.add_argument("--weights-prefix", category="input", dest="weightsprefix", type=op.file,
                     help="loads probabilities for being source, destination and via-edge from the files named " +
-                    "'prefix'.src.xml, 'prefix'.dst.xml and 'prefix'.via.xml")
+                    "'prefix'.src.xml, 'prefix'.dst.xml and 'prefix'.via.xml (or .npz / .parquet); " +
+                    "xml files with several intervals give the weights for the departure intervals starting within")
+    op.add_argument("--od-matrix", category="input", dest="odMatrix", type=op.file,
+                    help="draw origin and destination zone of each trip from the CSV file with origin zone, " +
+                    "destination zone and number of trips in its first three columns (requires --zones)")
+    op.add_argument("--zones", category="input", type=op.additional_file,
+                    help="load the zone polygons for --od-matrix from the poly or taz elements of FILE, " +
+                    "an edge belongs to the first zone containing its midpoint")
+    op.add_argument("--weights-cache", category="input", dest="weightsCache", action="store_true", default=False,
+                    help="store the weights loaded with --weights-prefix as array in the edge order of the network " +
+                    "next to the weights files and reuse them as long as the files and the network do not change")
     # output
     op.add_argument("-o", "--output-trip-file", category="output", dest="tripfile", type=op.route_file,
                     default="trips.trips.xml",
-                    help="define the output trip filename")
+                    help="define the output trip filename (compressed if it ends with .gz)")
     op.add_argument("-r", "--route-file", category="output", dest="routefile", type=op.route_file,
                     help="generates route file with duarouter")
+    op.add_argument("--trip-table", category="output", dest="tripTable", type=op.file,
+                    help="additionally write the generated trips as a table for analysis " +
+                    "(CSV, or Parquet if the filename ends with .parquet)")
+    op.add_argument("--od-table", category="output", dest="odTable", type=op.file,
+                    help="write the number of sampled trips per interval, origin and destination as table " +
+                    "(CSV, or Parquet if the filename ends with .parquet)")
+    op.add_argument("--profile", category="output", action="store_true", default=False,
+                    help="write wall time and CPU time of each phase and sampling statistics " +
+                    "as JSON to the trip file name with suffix .profile.json; the peak memory given per phase " +
+                    "is the peak of the whole process (and of its largest child process) up to the end of the phase")
     op.add_argument("--vtype-output", category="output", dest="vtypeout", type=op.file,
                     help="Store generated vehicle types in a separate file")
     op.add_argument("--weights-output-prefix", category="output", dest="weights_outprefix", type=op.file,
-                    help="generates weights files for visualisation")
+                    help="generates weights files for visualisation, with one interval per departure interval " +
+                    "if the weights change with the interval")
+    op.add_argument("--weights-output-format", category="output", dest="weightsOutputFormat", default="xml",
+                    choices=WEIGHT_FORMATS,
+                    help="write the weights files as edgedata xml or in a binary format for fast reloading " +
+                    "(parquet requires pyarrow)")
     # persons
     op.add_argument("--pedestrians", category="persons", action="store_true", default=False,
                     help="create a person file with pedestrian trips instead of vehicle trips")
@@ -84,6 +146,9 @@ def get_options(args=None):
                     help="Create trips that start at stopping places of the indicated type(s). i.e. 'busStop'")
     op.add_argument("--to-stops", category="persons", dest="toStops",
                     help="Create trips that end at stopping places of the indicated type(s). i.e. 'busStop'")
+    op.add_argument("--stops-cache", category="persons", dest="stopsCache", action="store_true", default=False,
+                    help="store the stopping places of each additional file in a file next to it and reuse them " +
+                    "as long as the additional file and the stop types do not change")
     # attributes
     op.add_argument("--prefix", category="attributes", dest="tripprefix", default="",
                     help="prefix for the trip ids")
@@ -111,13 +176,16 @@ def get_options(args=None):
     op.add_argument("--speed-exponent", category="weights", dest="speed_exponent", metavar="FLOAT", type=float,
                     default=0.0, help="weight edge probability by speed^'FLOAT' (default 0)")
     op.add_argument("--fringe-speed-exponent", category="weights", dest="fringe_speed_exponent", metavar="FLOAT",
-                    help="weight fringe edge probability by speed^'FLOAT' (default: speed exponent)")
+                    type=float, help="weight fringe edge probability by speed^'FLOAT' (default: speed exponent)")
     op.add_argument("--angle", category="weights", dest="angle", default=90.0, type=float,
                     help="weight edge probability by angle [0-360] relative to the network center")
     op.add_argument("--angle-factor", category="weights", dest="angle_weight", default=1.0, type=float,
                     help="maximum weight factor for angle")
     op.add_argument("--random-factor", category="weights", dest="randomFactor", default=1.0, type=float,
                     help="edge weights are dynamically disturbed by a random factor drawn uniformly from [1,FLOAT]")
+    op.add_argument("--random-factor.per-interval", category="weights", dest="randomFactorPerInterval",
+                    action="store_true", default=False,
+                    help="draw new random factors for every interval of --period / --insertion-rate")
     op.add_argument("--fringe-factor", category="weights", dest="fringe_factor", default="1.0",
                     help="multiply weight of fringe edges by 'FLOAT' (default 1)" +
                     " or set value 'max' to force all traffic to start/end at the fringe.")
@@ -156,6 +224,18 @@ def get_options(args=None):
                     help="Create flows without destination as input for jtrrouter")
     op.add_argument("--maxtries", default=100, type=int,
                     help="number of attemps for finding a trip which meets the distance constraints")
+    op.add_argument("--batch-size", dest="batchSize", default=0, type=int,
+                    help="sample trips in batches of INT candidates and check the distance constraints on arrays " +
+                    "(default 0 samples one trip at a time)")
+    op.add_argument("--spatial-sinks", dest="spatialSinks", action="store_true", default=False,
+                    help="draw the sink directly among the edges within the distance limits around the source " +
+                    "instead of rejecting trips (sources keep their probability, ignored with intermediate edges)")
+    op.add_argument("--check-reachability", dest="checkReachability", action="store_true", default=False,
+                    help="reject trips whose sink (or next via edge) cannot be reached from the source " +
+                    "for the vehicle class, determined from the strongly connected components of the network")
+    op.add_argument("--jobs", default=1, type=int,
+                    help="split the departure times into INT consecutive chunks which are sampled in parallel " +
+                    "processes, each with its own seed derived from --seed")
     op.add_argument("--remove-loops", dest="remove_loops", action="store_true", default=False,
                     help="Remove loops at route start and end")
     op.add_argument("--random-routing-factor", dest="randomRoutingFactor", default=1, type=float,
@@ -184,11 +264,17 @@ def get_options(args=None):
                        "(alternative to the period option).")
     op.add_argument("--flows", category="flow", default=0, type=int,
                     help="generates INT flows that together output vehicles with the specified period")
+    op.add_argument("--aggregate", category="flow", action="store_true", default=False,
+                    help="count the sampled trips per interval, origin, destination and via edges and write one " +
+                    "flow with the number of vehicles for each instead of single trips")
     op.add_argument("--random-depart", category="flow", action="store_true", dest="randomDepart", default=False,
-                    help="Distribute departures randomly between begin and end")
+                    help="Distribute departures randomly between begin and end. The departures are drawn as " +
+                    "arrays with numpy, so the output for a given seed differs from versions drawing them one by one")
     op.add_argument("--binomial",  category="flow", metavar="N", type=int,
                     help="If this is set, the number of departures per second will be drawn from a binomial " +
-                    "distribution with n=N and p=PERIOD/N where PERIOD is the argument given to --period")
+                    "distribution with n=N and p=PERIOD/N where PERIOD is the argument given to --period. " +
+                    "The counts are drawn as arrays with numpy, so the output for a given seed differs from " +
+                    "versions drawing them one by one")
 
     try:
         options = op.parse_args(args=args)
@@ -217,17 +303,9 @@ def get_options(args=None):
     if options.period is None and options.insertionRate is None and options.insertionDensity is None:
         options.period = [1.]
 
-    options.net = sumolib.net.readNet(options.netfile)
-    if options.insertionDensity:
-        # Compute length of the network
-        length = 0.  # In meters
-        for edge in options.net.getEdges():
-            if edge.allows(options.vclass):
-                length += edge.getLaneNumber() * edge.getLength()
-        options.insertionRate = [density * (length / 1000.0) for density in options.insertionDensity]
-
-    if options.insertionRate:
-        options.period = [3600.0 / rate for rate in options.insertionRate]
+    options.profiler = Profile() if options.profile else None
+    with Profile.phase_of(options, "load_net"):
+        set_net(options, net if net is not None else load_net(options.netfile, options.netCache))
 
     if options.period:
         if any(options.period) <= 0:
@@ -274,7 +352,7 @@ def get_options(args=None):
 
     if options.weightsprefix:
         weight_files = [options.weightsprefix + s for s in (SOURCE_SUFFIX, DEST_SUFFIX, VIA_SUFFIX)]
-        if not any([os.path.isfile(w) for w in weight_files]):
+        if not any([find_weights(options.weightsprefix, s) for s in (SOURCE_SUFFIX, DEST_SUFFIX, VIA_SUFFIX)]):
             print("Error: None of the weight files '%s' exists." % "', '".join(weight_files), file=sys.stderr)
             sys.exit(1)
 
@@ -282,8 +360,36 @@ def get_options(args=None):
         print("Error: Option --random-factor requires a value >= 1.")
         sys.exit(1)
 
+    if options.batchSize < 0:
+        print("Error: Option --batch-size may not be negative", file=sys.stderr)
+        sys.exit(1)
+
+    if options.jobs < 1:
+        print("Error: Option --jobs must be positive", file=sys.stderr)
+        sys.exit(1)
+
+    if options.jobs > 1 and options.flows > 0:
+        print("Error: Option --jobs cannot be used together with option --flows", file=sys.stderr)
+        sys.exit(1)
+
+    if options.odMatrix:
+        for conflict, name in ((not options.zones, "Option --zones is required for"),
+                               (options.intermediate > 0, "Option --intermediate cannot be used together with"),
+                               (options.spatialSinks, "Option --spatial-sinks cannot be used together with")):
+            if conflict:
+                print("Error: %s option --od-matrix" % name, file=sys.stderr)
+                sys.exit(1)
+
+    if options.aggregate or options.odTable:
+        for conflict, name in ((options.flows > 0, "--flows"), (options.jobs > 1, "--jobs"),
+                               (options.aggregate and options.pedestrians, "--pedestrians")):
+            if conflict:
+                print("Error: Options --aggregate and --od-table cannot be used together with option %s" % name,
+                      file=sys.stderr)
+                sys.exit(1)
+
     if options.fromStops or options.toStops:
-        options.edgeFromStops, options.edgeToStops = loadStops(options)
+        options.stops = loadStops(options)
 
     if options.viaEdgeTypes:
         options.viaEdgeTypes = options.viaEdgeTypes.split(',')
@@ -305,13 +411,204 @@ def get_options(args=None):
     return options
 
 
+def set_net(options, net):
+    """binds the options to the given network and derives the network dependent insertion periods"""
+    options.net = net
+    options.edge_table = None
+    options.stop_index = None
+    if options.insertionDensity:
+        # Compute length of the network
+        length = 0.  # In meters
+        for edge in net.getEdges():
+            if edge.allows(options.vclass):
+                length += edge.getLaneNumber() * edge.getLength()
+        options.insertionRate = [density * (length / 1000.0) for density in options.insertionDensity]
+
+    if options.insertionRate:
+        options.period = list(map(intIfPossible, [3600.0 / rate for rate in options.insertionRate]))
+
+
 class InvalidGenerator(Exception):
     pass
 
 
+def weights_name(prefix, suffix, fmt="xml"):
+    return prefix + os.path.splitext(suffix)[0] + "." + fmt
+
+
+def find_weights(prefix, suffix):
+    """returns the weights file for the given prefix and suffix in the first format that exists or None"""
+    for fmt in WEIGHT_FORMATS:
+        fname = weights_name(prefix, suffix, fmt)
+        if os.path.isfile(fname):
+            return fname
+    return None
+
+
+def import_pyarrow(purpose):
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa
+    except ImportError:
+        print("Error: %s requires the module pyarrow" % purpose, file=sys.stderr)
+        sys.exit(1)
+    return pyarrow
+
+
+def file_hash(fname):
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _is_net_object(obj):
+    return type(obj).__module__.startswith("sumolib.") and hasattr(obj, "__dict__")
+
+
+class _NetPickler(pickle.Pickler):
+    """pickles a sumolib network in two flat parts, first all objects without their state and then all
+       states, so that pickling does not recurse along the road graph"""
+
+    def __init__(self, f):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self.shells = False
+
+    def reducer_override(self, obj):
+        if self.shells and _is_net_object(obj):
+            return object.__new__, (type(obj),)
+        return NotImplemented
+
+    def dump_net(self, key, net):
+        # collect all objects reachable from the network without recursion
+        objects = [net]
+        seen = {id(net)}
+        pending = [vars(net)]
+        while pending:
+            value = pending.pop()
+            if isinstance(value, dict):
+                values = list(value.keys()) + list(value.values())
+            elif isinstance(value, (list, tuple, set, frozenset)):
+                values = value
+            else:
+                continue
+            for v in values:
+                if isinstance(v, (str, float, int)) or id(v) in seen:
+                    continue
+                seen.add(id(v))
+                if _is_net_object(v):
+                    objects.append(v)
+                    pending.append(vars(v))
+                else:
+                    pending.append(v)
+
+        states = []
+        for obj in objects:
+            state = dict(vars(obj))
+            if isinstance(obj, sumolib.net.Net):
+                # caches and the edge type defaults are recreated when loading
+                for attr in ("_rtreeEdges", "_rtreeLanes", "_shortestPathCache", "_routingCache", "_proj"):
+                    state.pop(attr, None)
+                state["_edgeTypes"] = dict(obj._edgeTypes)
+            states.append(state)
+
+        self.dump(key)
+        self.shells = True
+        self.dump(objects)
+        self.shells = False
+        # all objects are memoized now and only referenced from the states
+        self.dump(states)
+
+
+def _load_net_states(unpickler):
+    # the garbage collector would repeatedly scan the many new containers while loading
+    gc.disable()
+    try:
+        objects = unpickler.load()
+        states = unpickler.load()
+    finally:
+        gc.enable()
+    for obj, state in zip(objects, states):
+        if isinstance(obj, sumolib.net.Net):
+            obj.__init__()
+            obj._edgeTypes.update(state.pop("_edgeTypes"))
+        obj.__dict__.update(state)
+    return objects[0]
+
+
+def load_net(netfile, cache=False):
+    """reads the network, optionally through a binary cache file keyed by the content hash of the net file
+       and the sumolib version, whose classes are pickled"""
+    if not cache:
+        return sumolib.net.readNet(netfile)
+
+    cachefile = netfile + NET_CACHE_SUFFIX
+    key = (file_hash(netfile), sumolib.__version__)
+    if os.path.isfile(cachefile):
+        try:
+            with open(cachefile, "rb") as f:
+                unpickler = pickle.Unpickler(f)
+                if unpickler.load() == key:
+                    return _load_net_states(unpickler)
+        except Exception as e:
+            print("Warning: could not read network cache '%s' (%s)" % (cachefile, e), file=sys.stderr)
+
+    net = sumolib.net.readNet(netfile)
+    # write to a temporary file first because other processes may read the cache concurrently
+    tmpfile = "%s.%s.tmp" % (cachefile, os.getpid())
+    with open(tmpfile, "wb") as f:
+        _NetPickler(f).dump_net(key, net)
+    os.replace(tmpfile, cachefile)
+    return net
+
+
+def fringe_flags(net):
+    """returns the fringe classification bits of all edges as array aligned with net._edges,
+       computed once per network"""
+    flags = getattr(net, "_fringeFlags", None)
+    if flags is None:
+        flags = np.array([(FRINGE_INCOMING * edge.is_fringe(edge._incoming)) |
+                          (FRINGE_OUTGOING * edge.is_fringe(edge._outgoing)) |
+                          (FRINGE_JUNCTION_INCOMING * edge.is_fringe(edge._incoming, checkJunctions=True)) |
+                          (FRINGE_JUNCTION_OUTGOING * edge.is_fringe(edge._outgoing, checkJunctions=True))
+                          for edge in net._edges], dtype=np.uint8)
+        net._fringeFlags = flags
+    return flags
+
+
+def read_stops(fname, stopTypes, cache=False):
+    """returns arrays with type, id and edge id of the stopping places of the given types in an additional file,
+       optionally through a cache file keyed by the content of the file and the stop types"""
+    if cache:
+        cachefile = fname + STOPS_CACHE_SUFFIX
+        key = "%s %s" % (file_hash(fname), ",".join(sorted(stopTypes)))
+        if os.path.isfile(cachefile):
+            try:
+                with np.load(cachefile) as data:
+                    if str(data["key"]) == key:
+                        return data["types"], data["ids"], data["edges"]
+            except Exception as e:
+                print("Warning: could not read stops cache '%s' (%s)" % (cachefile, e), file=sys.stderr)
+
+    types, ids, edges = [], [], []
+    for stop in sumolib.xml.parse(fname, stopTypes):
+        types.append(stop.name)
+        ids.append(stop.id)
+        edges.append(stop.lane.rsplit('_', 1)[0])
+    stops = np.array(types, dtype=str), np.array(ids, dtype=str), np.array(edges, dtype=str)
+
+    if cache:
+        # write to a temporary file first because other processes may read the cache concurrently
+        tmpfile = "%s.%s.tmp" % (cachefile, os.getpid())
+        with open(tmpfile, "wb") as f:
+            np.savez(f, key=key, types=stops[0], ids=stops[1], edges=stops[2])
+        os.replace(tmpfile, cachefile)
+    return stops
+
+
 def loadStops(options):
-    edgeFromStops = defaultdict(list)  # edge -> [(stopType1, stopID1), ...]
-    edgeToStops = defaultdict(list)  # edge -> [(stopType1, stopID1), ...]
+    """returns arrays with type, id and edge id of the stopping places for --from-stops and --to-stops"""
     if options.additional is None:
         print("Error: Option %s requires option --additional-files for loading infrastructure elements" %
               ("--from-stops" if options.fromStops else "--to-stops"), file=sys.stderr)
@@ -327,32 +624,168 @@ def loadStops(options):
         stopTypes += options.toStops
     else:
         options.toStops = []
-    stopTypes = list(set(stopTypes))
-    typeCounts = defaultdict(lambda: 0)
-    for additional in options.additional.split(','):
-        for stop in sumolib.xml.parse(additional, stopTypes):
-            edgeID = stop.lane.rsplit('_', 1)[0]
-            if stop.name in options.fromStops:
-                edgeFromStops[edgeID].append((stop.name, stop.id))
-            if stop.name in options.toStops:
-                edgeToStops[edgeID].append((stop.name, stop.id))
-            typeCounts[stop.name] += 1
+    stopTypes = sorted(set(stopTypes))
+    stops = [read_stops(additional, stopTypes, options.stopsCache) for additional in options.additional.split(',')]
+    types, ids, edges = [np.concatenate(column) for column in zip(*stops)]
 
-    if options.fromStops:
-        available = sum([typeCounts[t] for t in options.fromStops])
-        if available == 0:
-            print("No stops of type%s '%s' were found in additional-files %s" % (
-                ('' if len(options.fromStops) == 1 else 's'),
-                options.fromStops[0], options.additional), file=sys.stderr)
-            sys.exit(1)
-    if options.toStops:
-        available = sum([typeCounts[t] for t in options.toStops])
-        if available == 0:
+    for wanted in (options.fromStops, options.toStops):
+        if wanted and not np.isin(types, wanted).any():
             print("No stops of type%s '%s' were found in additional-files %s" % (
-                ('' if len(options.toStops) == 1 else 's'),
-                options.toStops[0], options.additional), file=sys.stderr)
+                ('' if len(wanted) == 1 else 's'),
+                wanted[0], options.additional), file=sys.stderr)
             sys.exit(1)
-    return edgeFromStops, edgeToStops
+    return types, ids, edges
+
+
+class StopIndex:
+    """the stopping places of some types grouped by edge in the order of net._edges. Together with drawing
+       the edge by its weight times the number of stops (see get_prob_fun), drawing a stop uniformly among
+       those of the edge draws each stop by the weight of its edge."""
+
+    def __init__(self, table, stops, stopTypes):
+        types, ids, edges = stops
+        edge = np.array([table.index.get(e, -1) for e in edges], dtype=np.int64)
+        selected = np.flatnonzero(np.isin(types, stopTypes) & (edge >= 0))
+        # stable, so the stops of an edge stay in file order
+        selected = selected[np.argsort(edge[selected], kind="stable")]
+        self.index = table.index
+        self.counts = np.bincount(edge[selected], minlength=len(table))
+        # the stop attribute as written to the trip file
+        self.attrs = [' %s="%s"' % (types[k], ids[k]) for k in selected]
+        # plain lists are much faster than numpy arrays for scalar access
+        self._start = np.concatenate(([0], np.cumsum(self.counts))).tolist()
+        self._counts = self.counts.tolist()
+
+    def draw(self, edgeID):
+        """returns the attribute of a random stop on the edge using the global random module"""
+        i = self.index[edgeID]
+        return self.attrs[self._start[i] + random.randrange(self._counts[i])]
+
+
+def get_stop_index(options, stopTypes):
+    if options.stop_index is None:
+        options.stop_index = {}
+    key = tuple(stopTypes)
+    if key not in options.stop_index:
+        options.stop_index[key] = StopIndex(get_edge_table(options), options.stops, stopTypes)
+    return options.stop_index[key]
+
+
+class AliasTable:
+    """Walker/Vose alias table for drawing indices from a discrete distribution in O(1)"""
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        self.size = len(weights)
+        self.total_weight = float(weights.sum())
+        if self.total_weight <= 0:
+            raise InvalidGenerator()
+
+        scaled = weights * (self.size / self.total_weight)
+        prob = np.ones(self.size)
+        alias = np.arange(self.size)
+        small = list(np.flatnonzero(scaled < 1))
+        large = list(np.flatnonzero(scaled >= 1))
+        scaled = scaled.tolist()
+        while small and large:
+            s = small.pop()
+            g = large[-1]
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1 - scaled[s]
+            if scaled[g] < 1:
+                small.append(large.pop())
+        # remaining entries are 1 up to rounding errors and keep prob 1
+
+        self.prob = prob
+        self.alias = alias
+        # plain lists are much faster than numpy arrays for scalar access
+        self._prob = prob.tolist()
+        self._alias = alias.tolist()
+
+    def draw(self):
+        """draw a single index using the global random module"""
+        r = random.random() * self.size
+        i = int(r)
+        if r - i < self._prob[i]:
+            return i
+        return self._alias[i]
+
+    def draw_many(self, n, rng):
+        """draw n indices at once using the given numpy generator"""
+        i = rng.integers(0, self.size, size=n)
+        return np.where(rng.random(n) < self.prob[i], i, self.alias[i])
+
+
+class FenwickTree:
+    """discrete distribution over weights which supports changing single weights and drawing in O(log n)"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = np.array(weights, dtype=float)
+        # tree[i] holds the sum of the weights i - (i & -i) .. i - 1 (one based)
+        tree = [0.] + self.weights.tolist()
+        for i in range(1, self.size + 1):
+            j = i + (i & -i)
+            if j <= self.size:
+                tree[j] += tree[i]
+        self.tree = np.array(tree)
+        self.step = 1 << (self.size.bit_length() - 1) if self.size else 0
+        self.total_weight = self._prefix_sum(self.size)
+        if self.total_weight <= 0:
+            raise InvalidGenerator()
+
+    def _prefix_sum(self, i):
+        total = 0.
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return float(total)
+
+    def update(self, index, weight):
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def update_many(self, weights):
+        """sets all weights, only the changed ones are updated"""
+        for index in np.flatnonzero(weights != self.weights):
+            self.update(index, weights[index])
+        # the total as seen by the tree, so that draws stay below the last positive weight
+        self.total_weight = self._prefix_sum(self.size)
+        if self.total_weight <= 0:
+            raise InvalidGenerator()
+
+    def _find(self, x):
+        # descend the tree to the first index whose prefix sum exceeds x
+        pos = np.zeros(len(x), dtype=np.int64)
+        step = self.step
+        while step:
+            nxt = pos + step
+            ok = nxt <= self.size
+            ok[ok] = self.tree[nxt[ok]] <= x[ok]
+            x = np.where(ok, x - self.tree[np.minimum(nxt, self.size)], x)
+            pos = np.where(ok, nxt, pos)
+            step >>= 1
+        return np.minimum(pos, self.size - 1)
+
+    def draw(self):
+        x = random.random() * self.total_weight
+        pos = 0
+        step = self.step
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= x:
+                pos = nxt
+                x -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+    def draw_many(self, n, rng):
+        return self._find(rng.random(n) * self.total_weight)
 
 
 # assigns a weight to each edge using weight_fun and then draws from a discrete
@@ -361,37 +794,389 @@ def loadStops(options):
 
 class RandomEdgeGenerator:
 
-    def __init__(self, net, weight_fun):
+    def __init__(self, net, weight_fun, rng=None):
         self.net = net
         self.weight_fun = weight_fun
-        self.cumulative_weights = []
-        self.total_weight = 0
-        for edge in self.net._edges:
+        if isinstance(weight_fun, EdgeWeights):
+            # the weights for all of net._edges are already known
+            self.weights = np.asarray(weight_fun.weights, dtype=float)
+        else:
             # print edge.getID(), weight_fun(edge)
-            self.total_weight += weight_fun(edge)
-            self.cumulative_weights.append(self.total_weight)
-        if self.total_weight == 0:
-            raise InvalidGenerator()
+            self.weights = np.array([weight_fun(edge) for edge in self.net._edges], dtype=float)
+        self.table = AliasTable(self.weights)
+        self.total_weight = self.table.total_weight
+        self.rng = rng
 
     def get(self):
-        r = random.random() * self.total_weight
-        index = bisect.bisect(self.cumulative_weights, r)
-        return self.net._edges[index]
-
-    def write_weights(self, fname, interval_id, begin, end):
+        return self.net._edges[self.table.draw()]
+
+    def update_weights(self, weights):
+        """replaces the weights, the alias table is exchanged for a tree in which only the changed weights
+           need to be updated"""
+        weights = np.asarray(weights, dtype=float)
+        if not isinstance(self.table, FenwickTree):
+            self.table = FenwickTree(self.weights)
+        self.table.update_many(weights)
+        self.weights = weights
+        self.total_weight = self.table.total_weight
+
+    def get_rng(self, rng=None):
+        """returns rng or the numpy generator of this edge generator"""
+        if rng is None:
+            if self.rng is None:
+                # derived lazily from the seeded global random module so that
+                # constructing a generator does not alter the random sequence
+                self.rng = np.random.default_rng(random.getrandbits(64))
+            rng = self.rng
+        return rng
+
+    def get_many(self, n, rng=None):
+        """returns an array of n indices into net._edges"""
+        return self.table.draw_many(n, self.get_rng(rng))
+
+    def write_weights(self, fname, interval_id, intervals):
+        """writes the weights of each interval (begin, end, weights) as edgedata xml, .npz or .parquet
+           (depending on fname). With several intervals, npz and parquet get begin and end columns"""
+        ids = np.array([e.getID() for e in self.net._edges])
         # normalize to [0,100]
-        normalizer = 100.0 / max(1, max(map(self.weight_fun, self.net._edges)))
-        weights = [(self.weight_fun(e) * normalizer, e.getID()) for e in self.net.getEdges()]
-        weights.sort(reverse=True)
-        with open(fname, 'w+') as f:
-            f.write('<edgedata>\n')
-            f.write('    <interval id="%s" begin="%s" end="%s">\n' % (
-                interval_id, begin, end))
-            for weight, edgeID in weights:
-                f.write('        <edge id="%s" value="%0.2f"/>\n' %
-                        (edgeID, weight))
-            f.write('    </interval>\n')
-            f.write('</edgedata>\n')
+        intervals = [(begin, end, weights * (100.0 / max(1, weights.max(initial=0))))
+                     for begin, end, weights in intervals]
+        if fname.endswith(".npz") or fname.endswith(".parquet"):
+            columns = {"id": np.tile(ids, len(intervals)),
+                       "value": np.concatenate([weights for _, _, weights in intervals])}
+            if len(intervals) > 1:
+                columns["begin"] = np.repeat([float(begin) for begin, _, _ in intervals], len(ids))
+                columns["end"] = np.repeat([float(end) for _, end, _ in intervals], len(ids))
+            if fname.endswith(".npz"):
+                np.savez_compressed(fname, **columns)
+            else:
+                pyarrow = import_pyarrow("Writing Parquet weights")
+                pyarrow.parquet.write_table(pyarrow.table(columns), fname)
+        else:
+            with open(fname, 'w+') as f:
+                f.write('<edgedata>\n')
+                for begin, end, weights in intervals:
+                    # sorted by descending weight and descending id for ties
+                    order = np.lexsort((ids, weights))[::-1]
+                    f.write('    <interval id="%s" begin="%s" end="%s">\n' % (
+                        interval_id, begin, end))
+                    f.write("".join(['        <edge id="%s" value="%0.2f"/>\n' % (edgeID, weight)
+                                     for edgeID, weight in zip(ids[order].tolist(), weights[order].tolist())]))
+                    f.write('    </interval>\n')
+                f.write('</edgedata>\n')
+
+
+def strongly_connected_components(successors):
+    """returns the component of each node and the number of components (iterative Tarjan).
+       Components are numbered in reverse topological order, i.e. successors come first"""
+    n = len(successors)
+    index = [-1] * n
+    low = [0] * n
+    onStack = [False] * n
+    component = [-1] * n
+    stack = []
+    counter = 0
+    numComponents = 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onStack[root] = True
+        work = [(root, 0)]
+        while work:
+            v, pos = work[-1]
+            if pos < len(successors[v]):
+                work[-1] = (v, pos + 1)
+                w = successors[v][pos]
+                if index[w] < 0:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    onStack[w] = True
+                    work.append((w, 0))
+                elif onStack[w]:
+                    low[v] = min(low[v], index[w])
+                continue
+            work.pop()
+            if work:
+                u = work[-1][0]
+                low[u] = min(low[u], low[v])
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    onStack[w] = False
+                    component[w] = numComponents
+                    if w == v:
+                        break
+                numComponents += 1
+    return component, numComponents
+
+
+class Reachability:
+    """answers whether an edge can be reached from another edge for a vehicle class
+       using the strongly connected components of the edge graph and their condensation"""
+
+    # limit for the memory of the cached sets of reachable components in bytes
+    CACHE_BYTES = 64 << 20
+
+    def __init__(self, net, vclass):
+        index = {edge: i for i, edge in enumerate(net._edges)}
+        successors = []
+        for edge in net._edges:
+            successors.append([index[toEdge] for toEdge, cons in edge.getOutgoing().items()
+                               if toEdge in index and any(c.allows(vclass) and c.getFromLane().allows(vclass)
+                                                          and c.getToLane().allows(vclass) for c in cons)])
+        component, self.size = strongly_connected_components(successors)
+        self.component = np.array(component, dtype=np.int64)
+        dag = [set() for _ in range(self.size)]
+        for i, succ in enumerate(successors):
+            for j in succ:
+                if component[i] != component[j]:
+                    dag[component[i]].add(component[j])
+        self.dag = [list(succ) for succ in dag]
+        self.cache = {}
+
+    def _reachable(self, c):
+        """returns the components reachable from component c as bitset (see numpy.packbits)"""
+        bits = self.cache.get(c)
+        if bits is None:
+            if (len(self.cache) + 1) * (self.size // 8 + 1) > self.CACHE_BYTES:
+                self.cache.clear()
+            reach = np.zeros(self.size, dtype=bool)
+            reach[c] = True
+            stack = [c]
+            while stack:
+                for d in self.dag[stack.pop()]:
+                    if not reach[d]:
+                        reach[d] = True
+                        stack.append(d)
+            bits = self.cache[c] = np.packbits(reach)
+        return bits
+
+    @staticmethod
+    def _contains(bits, c):
+        """true for the components c (scalar or array) which are in the bitset"""
+        return (bits[c >> 3] >> (7 - (c & 7))) & 1 == 1
+
+    def connected(self, path):
+        """true if each edge index of the path can be reached from its predecessor"""
+        for i, j in zip(path[:-1], path[1:]):
+            ci, cj = self.component[i], self.component[j]
+            if ci != cj and not self._contains(self._reachable(ci), cj):
+                return False
+        return True
+
+    def connected_many(self, path):
+        """vectorized connected for a list of edge index arrays"""
+        result = np.ones(len(path[0]), dtype=bool)
+        for source, sink in zip(path[:-1], path[1:]):
+            cs, ct = self.component[source], self.component[sink]
+            for c in np.unique(cs[cs != ct]):
+                mask = cs == c
+                result[mask] &= self._contains(self._reachable(c), ct[mask])
+        return result
+
+
+class SpatialSinkSampler:
+    """draws sink edges by weight among the edges whose destination point lies within the distance ring
+       [min_distance, max_distance) around the source point, using a uniform grid with prefix sums per cell.
+       The edges within the ring are determined once per source node and cached."""
+
+    # number of cells per maximum distance, limit for the grid and for the memory of the cached ring queries in bytes
+    CELLS_PER_DISTANCE = 4
+    MAX_CELLS_PER_AXIS = 1024
+    CACHE_BYTES = 256 << 20
+
+    def __init__(self, weights, source_xy, source_node, dest_xy, min_distance, max_distance):
+        self.source_xy = source_xy
+        self.source_node = source_node
+        self.min_distance = min_distance
+        self.max_distance = math.inf if max_distance is None else max_distance
+        candidates = np.flatnonzero(weights > 0)
+        xy = dest_xy[candidates]
+        self.origin = xy.min(axis=0)
+        extent = float((xy.max(axis=0) - self.origin).max())
+        if max_distance is None:
+            size = extent / 64
+        else:
+            size = max_distance / self.CELLS_PER_DISTANCE
+        self.size = max(size, extent / self.MAX_CELLS_PER_AXIS, 1e-3)
+        cell_xy = ((xy - self.origin) // self.size).astype(np.int64)
+        self.shape = cell_xy.max(axis=0) + 1
+        cell = cell_xy[:, 0] * self.shape[1] + cell_xy[:, 1]
+        order = np.argsort(cell, kind="stable")
+        # edges, points and cumulative weights sorted by cell, the edges of cell c are start[c]:start[c + 1]
+        self.edges = candidates[order]
+        self.xy = xy[order]
+        self.cum = np.concatenate(([0.], np.cumsum(weights[self.edges])))
+        self.start = np.concatenate(([0], np.cumsum(np.bincount(cell, minlength=self.shape[0] * self.shape[1]))))
+        self.cache = {}
+        self.cache_bytes = 0
+
+    def _query(self, c):
+        """returns start and end positions and the cumulative weights of the edge ranges within the ring around c"""
+        if math.isinf(self.max_distance):
+            lo, hi = np.zeros(2, dtype=np.int64), self.shape - 1
+        else:
+            lo = np.clip(((c - self.max_distance - self.origin) // self.size), 0, self.shape - 1).astype(np.int64)
+            hi = np.clip(((c + self.max_distance - self.origin) // self.size), 0, self.shape - 1).astype(np.int64)
+        nx, ny = hi - lo + 1
+        cx = np.repeat(np.arange(lo[0], hi[0] + 1), ny)
+        cy = np.tile(np.arange(lo[1], hi[1] + 1), nx)
+        cell = cx * self.shape[1] + cy
+        begin, end = self.start[cell], self.start[cell + 1]
+        # distance range between c and the rectangle of each cell
+        x0 = self.origin[0] + cx * self.size - c[0]
+        y0 = self.origin[1] + cy * self.size - c[1]
+        x1, y1 = x0 + self.size, y0 + self.size
+        dmin = np.hypot(np.maximum(0, np.maximum(x0, -x1)), np.maximum(0, np.maximum(y0, -y1)))
+        dmax = np.hypot(np.maximum(np.abs(x0), np.abs(x1)), np.maximum(np.abs(y0), np.abs(y1)))
+        full = (end > begin) & (dmin >= self.min_distance) & (dmax < self.max_distance)
+        partial = (end > begin) & ~full & (dmax >= self.min_distance) & (dmin < self.max_distance)
+        # cells crossed by the ring boundary are checked edge by edge
+        lengths = end[partial] - begin[partial]
+        positions = np.repeat(begin[partial] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions += np.arange(len(positions))
+        delta = self.xy[positions] - c
+        distance = np.sqrt((delta * delta).sum(axis=1))
+        positions = positions[(distance >= self.min_distance) & (distance < self.max_distance)]
+        starts = np.concatenate((begin[full], positions))
+        ends = np.concatenate((end[full], positions + 1))
+        return starts, ends, np.cumsum(self.cum[ends] - self.cum[starts])
+
+    def _ranges(self, source):
+        node = self.source_node[source]
+        ranges = self.cache.get(node)
+        if ranges is None:
+            ranges = self._query(self.source_xy[source])
+            size = sum(a.nbytes for a in ranges)
+            # the oldest entries are evicted until the new one fits
+            while self.cache and self.cache_bytes + size > self.CACHE_BYTES:
+                self.cache_bytes -= sum(a.nbytes for a in self.cache.pop(next(iter(self.cache))))
+            self.cache[node] = ranges
+            self.cache_bytes += size
+        return ranges
+
+    def _lookup(self, ranges, u):
+        starts, ends, total = ranges
+        x = u * total[-1]
+        k = np.minimum(np.searchsorted(total, x, side="right"), len(total) - 1)
+        offset = x - np.where(k > 0, total[k - 1], 0.)
+        pos = np.searchsorted(self.cum, self.cum[starts[k]] + offset, side="right") - 1
+        return self.edges[np.clip(pos, starts[k], ends[k] - 1)]
+
+    def draw(self, source, u):
+        """returns the index of a sink edge for the given source edge index and a uniform number u in [0, 1)
+           or None if there is no edge within the ring"""
+        ranges = self._ranges(source)
+        if len(ranges[2]) == 0:
+            return None
+        return int(self._lookup(ranges, u))
+
+    def draw_many(self, sources, u):
+        """returns sink edge indices for arrays of source edge indices and uniform numbers, -1 if there is none"""
+        result = np.full(len(sources), -1, dtype=np.int64)
+        order = np.argsort(self.source_node[sources], kind="stable")
+        first = np.flatnonzero(np.diff(self.source_node[sources[order]], prepend=-1))
+        for group in np.split(order, first[1:]):
+            ranges = self._ranges(sources[group[0]])
+            if len(ranges[2]) > 0:
+                result[group] = self._lookup(ranges, u[group])
+        return result
+
+
+def read_zones(fname, net):
+    """returns the ids and shapes (arrays in network coordinates) of the poly and taz elements with a shape"""
+    ids = []
+    shapes = []
+    for zone in sumolib.xml.parse(fname, ("poly", "taz")):
+        if not zone.hasAttribute("shape"):
+            continue
+        shape = [tuple(map(float, point.split(",")))[:2] for point in zone.shape.split()]
+        if zone.getAttributeSecure("geo", "false") in ("true", "1"):
+            shape = [net.convertLonLat2XY(*point) for point in shape]
+        ids.append(zone.id)
+        shapes.append(np.array(shape))
+    return ids, shapes
+
+
+def points_in_polygon(points, shape):
+    """returns which of the points lie within the polygon (even-odd rule)"""
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(shape, np.roll(shape, -1, axis=0)):
+        crossing = (y1 > y) != (y2 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inside ^= crossing & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+    return inside
+
+
+def read_od_matrix(fname):
+    """returns (origin zone, destination zone, number of trips) from the first three columns of a CSV file
+       with header, as written by create_od_matrix.py"""
+    with open(fname) as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [(row[0], row[1], float(row[2])) for row in reader if row]
+
+
+class ZoneODSampler:
+    """draws the origin and destination zone of a trip with the probabilities of an OD matrix
+       and then the source and sink edge within the zones from per-zone alias tables"""
+
+    def __init__(self, zone_of_edge, num_zones, pairs, source_weights, sink_weights):
+        """zone_of_edge holds the zone index of each edge (-1 outside of all zones),
+           pairs the (origin index, destination index, number of trips) of the matrix"""
+        order = np.argsort(zone_of_edge, kind="stable")
+        bounds = np.searchsorted(zone_of_edge[order], np.arange(num_zones + 1))
+        self.zone_edges = [order[bounds[z]:bounds[z + 1]] for z in range(num_zones)]
+        self.pairs = pairs
+        self.set_weights(source_weights, sink_weights)
+
+    def _tables(self, weights):
+        tables = []
+        for edges in self.zone_edges:
+            try:
+                tables.append(AliasTable(weights[edges]))
+            except InvalidGenerator:
+                tables.append(None)
+        return tables
+
+    def set_weights(self, source_weights, sink_weights):
+        """builds the per-zone tables, OD pairs without valid source or sink edges are dropped"""
+        self.sources = self._tables(source_weights)
+        self.sinks = self._tables(sink_weights)
+        kept = [(o, d, n) for o, d, n in self.pairs if n > 0 and self.sources[o] and self.sinks[d]]
+        if not kept:
+            raise InvalidGenerator()
+        self.origin, self.destination, counts = map(np.array, zip(*kept))
+        self.dropped = sum(n for _, _, n in self.pairs) - counts.sum()
+        self.pair_table = AliasTable(counts)
+        self.prob = counts / counts.sum()
+
+    def draw(self):
+        """draws a single pair of source and sink edge index using the global random module"""
+        k = self.pair_table.draw()
+        o, d = self.origin[k], self.destination[k]
+        return self.zone_edges[o][self.sources[o].draw()], self.zone_edges[d][self.sinks[d].draw()]
+
+    def _draw_edges(self, zones, tables, rng):
+        edges = np.empty(len(zones), dtype=np.int64)
+        order = np.argsort(zones, kind="stable")
+        bounds = np.searchsorted(zones[order], np.arange(len(tables) + 1))
+        for z, table in enumerate(tables):
+            group = order[bounds[z]:bounds[z + 1]]
+            if len(group):
+                edges[group] = self.zone_edges[z][table.draw_many(len(group), rng)]
+        return edges
+
+    def draw_many(self, n, rng):
+        """draws arrays of n source and sink edge indices, the number of trips per OD pair is multinomial"""
+        pairs = rng.permutation(np.repeat(np.arange(len(self.prob)), rng.multinomial(n, self.prob)))
+        return (self._draw_edges(self.origin[pairs], self.sources, rng),
+                self._draw_edges(self.destination[pairs], self.sinks, rng))
 
 
 class RandomTripGenerator:
@@ -402,18 +1187,212 @@ class RandomTripGenerator:
         self.via_generator = via_generator
         self.intermediate = intermediate
         self.pedestrians = pedestrians
+        self.edge_arrays = None
+        self.sink_sampler = None
+        self.od_sampler = None
+        self.reachability = None
+        self.interval_weights = None
+        # counts of candidates, trips and rejection reasons, only collected if set to a Counter
+        self.stats = None
+
+    def use_spatial_sinks(self, min_distance, max_distance):
+        """draw sinks conditioned on the distance to the source, only possible without intermediate edges"""
+        from_xy, to_xy, from_node = self._get_edge_arrays()[:3]
+        self.sink_sampler = SpatialSinkSampler(self.sink_generator.weights, from_xy, from_node,
+                                               from_xy if self.pedestrians else to_xy, min_distance, max_distance)
+
+    def use_od_matrix(self, zone_of_edge, num_zones, pairs):
+        """draw source and sink by OD matrix and zones instead of independently"""
+        self.od_sampler = ZoneODSampler(zone_of_edge, num_zones, pairs,
+                                        self.source_generator.weights, self.sink_generator.weights)
+
+    def seed(self, seed_sequence):
+        """reseeds the global random module and the array sampling of all edge generators"""
+        random.seed(int(seed_sequence.generate_state(1, np.uint64)[0]))
+        rng = np.random.default_rng(seed_sequence)
+        for generator in (self.source_generator, self.sink_generator, self.via_generator):
+            if generator is not None:
+                generator.rng = rng
+
+    def _get_edge_arrays(self):
+        """coordinate, node and fringe arrays aligned with net._edges for batch sampling"""
+        if self.edge_arrays is None:
+            edges = self.source_generator.net._edges
+            nodes = {}
+            from_xy = np.empty((len(edges), 2))
+            to_xy = np.empty((len(edges), 2))
+            from_node = np.empty(len(edges), dtype=np.int64)
+            to_node = np.empty(len(edges), dtype=np.int64)
+            fringe = (fringe_flags(self.source_generator.net) & FRINGE_ANY) != 0
+            for i, edge in enumerate(edges):
+                from_xy[i] = edge.getFromNode().getCoord()[:2]
+                to_xy[i] = edge.getToNode().getCoord()[:2]
+                from_node[i] = nodes.setdefault(edge.getFromNode().getID(), len(nodes))
+                to_node[i] = nodes.setdefault(edge.getToNode().getID(), len(nodes))
+            self.edge_arrays = from_xy, to_xy, from_node, to_node, fringe
+        return self.edge_arrays
+
+    def _filter(self, accept, valid, reason):
+        """returns accept & valid and counts the candidates which are rejected for reason"""
+        if self.stats is not None:
+            self.stats[reason] += int(np.count_nonzero(accept & ~valid))
+        return accept & valid
+
+    def _take(self, accept, pending):
+        """returns the slots which are filled, the indices of their first accepted candidates and the slots
+           which are still pending. Candidate i is drawn for the pending slot i modulo the number of pending slots"""
+        accepted = np.flatnonzero(accept)
+        slots, first = np.unique(pending[accepted % len(pending)], return_index=True)
+        if self.stats is not None:
+            self.stats["candidates"] += len(accept)
+            self.stats["trips"] += len(slots)
+            self.stats["surplus"] += len(accepted) - len(slots)
+        return slots, accepted[first], np.setdiff1d(pending, slots)
+
+    def _rejection(self, distance, min_distance, max_distance, same_junction, path):
+        """returns the reason for rejecting a candidate trip or None if it is accepted,
+           the candidate is counted if sampling statistics are collected"""
+        if distance is not None and distance < min_distance:
+            reason = "min_distance"
+        elif distance is not None and max_distance is not None and distance >= max_distance:
+            reason = "max_distance"
+        elif same_junction:
+            reason = "junction"
+        elif self.reachability is not None and not self.reachability.connected(path):
+            reason = "unreachable"
+        else:
+            reason = None
+        self._count(reason)
+        return reason
+
+    def _count(self, reason):
+        if self.stats is not None:
+            self.stats["candidates"] += 1
+            self.stats["trips" if reason is None else reason] += 1
+
+    def get_trips(self, n, min_distance, max_distance, maxtries=100, junctionTaz=False, min_dist_fringe=None,
+                  batch_size=10000, rng=None):
+        """returns a list of n trips drawn in batches of candidates, which are None for the failed slots.
+           As in get_trip, at most maxtries candidates per slot are drawn for each distance threshold"""
+        from_xy, to_xy, from_node, to_node, fringe = self._get_edge_arrays()
+        dest_xy = from_xy if self.pedestrians else to_xy
+        edges = self.source_generator.net._edges
+        trips = [None] * n
+        pending = np.arange(n)
+        passes = [min_distance, min_dist_fringe]
+        if self.od_sampler is not None:
+            budget = maxtries * n
+            while budget > 0 and len(pending) > 0:
+                size = min(budget, batch_size)
+                budget -= size
+                source, sink = self.od_sampler.draw_many(size, self.source_generator.get_rng(rng))
+                delta = dest_xy[sink] - from_xy[source]
+                distance = np.sqrt((delta * delta).sum(axis=1))
+                accept = self._filter(np.ones(size, dtype=bool), distance >= min_distance, "min_distance")
+                if max_distance is not None:
+                    accept = self._filter(accept, distance < max_distance, "max_distance")
+                if junctionTaz:
+                    accept = self._filter(accept, from_node[source] != to_node[sink], "junction")
+                if self.reachability is not None:
+                    accept = self._filter(accept, self.reachability.connected_many([source, sink]), "unreachable")
+                slots, chosen, pending = self._take(accept, pending)
+                for slot, i in zip(slots, chosen):
+                    trips[slot] = (edges[source[i]], edges[sink[i]], [])
+            passes = []
+        if self.sink_sampler is not None:
+            budget = maxtries * n
+            while budget > 0 and len(pending) > 0:
+                size = min(budget, batch_size)
+                budget -= size
+                source = self.source_generator.get_many(size, rng)
+                sink = self.sink_sampler.draw_many(
+                    source, (self.source_generator.rng if rng is None else rng).random(size))
+                accept = self._filter(np.ones(size, dtype=bool), sink >= 0, "no_sink")
+                if junctionTaz:
+                    accept = self._filter(accept, from_node[source] != to_node[sink], "junction")
+                if self.reachability is not None:
+                    accept = self._filter(accept, self.reachability.connected_many([source, sink]), "unreachable")
+                slots, chosen, pending = self._take(accept, pending)
+                for slot, i in zip(slots, chosen):
+                    trips[slot] = (edges[source[i]], edges[sink[i]], [])
+            passes = [min_dist_fringe]
+        for min_dist in passes:
+            if min_dist is None:
+                break
+            if min_dist == min_dist_fringe and self.intermediate:
+                continue  # fringe to fringe trips cannot have intermediate edges
+            budget = maxtries * len(pending)
+            while budget > 0 and len(pending) > 0:
+                size = min(budget, batch_size)
+                budget -= size
+                source = self.source_generator.get_many(size, rng)
+                sink = self.sink_generator.get_many(size, rng)
+                points = [from_xy[source]]
+                if self.intermediate:
+                    via = self.via_generator.get_many(size * self.intermediate, rng).reshape(size, self.intermediate)
+                    points += [from_xy[via[:, j]] for j in range(self.intermediate)]
+                points.append(dest_xy[sink])
+                distance = np.zeros(size)
+                for p, q in zip(points[:-1], points[1:]):
+                    delta = q - p
+                    distance += np.sqrt((delta * delta).sum(axis=1))
+                accept = np.ones(size, dtype=bool)
+                if min_dist == min_dist_fringe:
+                    accept = self._filter(accept, fringe[source] & fringe[sink], "fringe")
+                accept = self._filter(accept, distance >= min_dist, "min_distance")
+                if max_distance is not None:
+                    accept = self._filter(accept, distance < max_distance, "max_distance")
+                if junctionTaz:
+                    accept = self._filter(accept, from_node[source] != to_node[sink], "junction")
+                if self.reachability is not None:
+                    accept = self._filter(accept, self.reachability.connected_many(
+                        [source] + ([via[:, j] for j in range(self.intermediate)] if self.intermediate else []) + [sink]),
+                        "unreachable")
+                slots, chosen, pending = self._take(accept, pending)
+                for slot, i in zip(slots, chosen):
+                    intermediate = [edges[j] for j in via[i]] if self.intermediate else []
+                    trips[slot] = (edges[source[i]], edges[sink[i]], intermediate)
+        if self.stats is not None:
+            self.stats["failed"] += len(pending)
+        return trips
 
     def get_trip(self, min_distance, max_distance, maxtries=100, junctionTaz=False, min_dist_fringe=None):
-        for min_dist in [min_distance, min_dist_fringe]:
+        passes = [min_distance, min_dist_fringe]
+        edges = self.source_generator.net._edges
+        if self.od_sampler is not None:
+            from_xy, to_xy, from_node, to_node = self._get_edge_arrays()[:4]
+            dest_xy = from_xy if self.pedestrians else to_xy
+            for _ in range(maxtries):
+                i, j = self.od_sampler.draw()
+                distance = euclidean(from_xy[i], dest_xy[j])
+                if self._rejection(distance, min_distance, max_distance,
+                                   junctionTaz and from_node[i] == to_node[j], [i, j]) is None:
+                    return edges[i], edges[j], []
+            passes = []
+        if self.sink_sampler is not None:
+            from_node, to_node = self._get_edge_arrays()[2:4]
+            for _ in range(maxtries):
+                i = self.source_generator.table.draw()
+                j = self.sink_sampler.draw(i, random.random())
+                if j is None:
+                    self._count("no_sink")
+                elif self._rejection(None, min_distance, max_distance,
+                                     junctionTaz and from_node[i] == to_node[j], [i, j]) is None:
+                    return edges[i], edges[j], []
+            passes = [min_dist_fringe]
+        for min_dist in passes:
             if min_dist is None:
                 break
+            fringe = self._get_edge_arrays()[4] if min_dist == min_dist_fringe else None
             for _ in range(maxtries):
-                source_edge = self.source_generator.get()
-                intermediate = [self.via_generator.get() for __ in range(self.intermediate)]
-                sink_edge = self.sink_generator.get()
-                is_fringe2fringe = source_edge.is_fringe() and sink_edge.is_fringe() and not intermediate
-                if min_dist == min_dist_fringe and not is_fringe2fringe:
-                    continue
+                i = self.source_generator.table.draw()
+                via = [self.via_generator.table.draw() for __ in range(self.intermediate)]
+                j = self.sink_generator.table.draw()
+                source_edge, sink_edge = edges[i], edges[j]
+                intermediate = [edges[k] for k in via]
+                if fringe is not None and (intermediate or not (fringe[i] and fringe[j])):
+                    self._count("fringe")
+                    continue  # not fringe to fringe
                 if self.pedestrians:
                     destCoord = sink_edge.getFromNode().getCoord()
                 else:
@@ -423,113 +1402,340 @@ class RandomTripGenerator:
                           [destCoord])
                 distance = sum([euclidean(p, q)
                                 for p, q in zip(coords[:-1], coords[1:])])
-                if (distance >= min_dist
-                        and (not junctionTaz or source_edge.getFromNode() != sink_edge.getToNode())
-                        and (max_distance is None or distance < max_distance)):
+                if self._rejection(distance, min_dist, max_distance,
+                                   junctionTaz and source_edge.getFromNode() == sink_edge.getToNode(),
+                                   [i] + via + [j]) is None:
                     return source_edge, sink_edge, intermediate
+        if self.stats is not None:
+            self.stats["failed"] += 1
         raise Exception("Warning: no trip found after %s tries" % maxtries)
 
 
+class EdgeTable:
+    """columnar edge attributes aligned with net._edges, computed once per network and options"""
+
+    def __init__(self, net, options):
+        edges = net._edges
+        self.ids = [edge.getID() for edge in edges]
+        self.index = {edgeID: i for i, edgeID in enumerate(self.ids)}
+        self.length = np.array([edge.getLength() for edge in edges], dtype=float)
+        self.lanes = np.array([edge.getLaneNumber() for edge in edges], dtype=float)
+        self.speed = np.array([edge.getSpeed() for edge in edges], dtype=float)
+        self.type = [edge.getType() for edge in edges]
+        self.params = {}
+        if options.vclass:
+            self.allowed = np.array([edge.allows(options.vclass) for edge in edges], dtype=bool)
+        else:
+            self.allowed = np.ones(len(edges), dtype=bool)
+        roundabouts = set()
+        for roundabout in net.getRoundabouts():
+            roundabouts.update(roundabout.getEdges())
+        self.roundabout = np.array([edgeID in roundabouts for edgeID in self.ids], dtype=bool)
+
+        # fringe flags: any direction, per direction and per direction honoring --fringe-junctions
+        flags = fringe_flags(net)
+        self.fringe = (flags & FRINGE_ANY) != 0
+        self.fringe_incoming = (flags & FRINGE_INCOMING) != 0
+        self.fringe_outgoing = (flags & FRINGE_OUTGOING) != 0
+        if options.fringeJunctions:
+            self.fringe_junction_incoming = (flags & FRINGE_JUNCTION_INCOMING) != 0
+            self.fringe_junction_outgoing = (flags & FRINGE_JUNCTION_OUTGOING) != 0
+        else:
+            self.fringe_junction_incoming = self.fringe_incoming
+            self.fringe_junction_outgoing = self.fringe_outgoing
+
+        self.angle = None
+        if options.angle_weight != 1.0:
+            # angle of the bounding box centre relative to the network centre
+            nx, ny = options.angle_center
+            self.angle = np.empty(len(edges))
+            for i, edge in enumerate(edges):
+                xmin, ymin, xmax, ymax = edge.getBoundingBox()
+                ex, ey = ((xmin + xmax) / 2, (ymin + ymax) / 2)
+                self.angle[i] = naviDegree(math.atan2(ey - ny, ex - nx))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def param(self, key, edges):
+        if key not in self.params:
+            self.params[key] = np.array([float(edge.getParam(key, 1.0)) for edge in edges], dtype=float)
+        return self.params[key]
+
+    def power(self, values, exponent):
+        # evaluated per distinct value with python floats to match scalar results exactly
+        unique, inverse = np.unique(values, return_inverse=True)
+        return np.array([float(v) ** exponent for v in unique], dtype=float)[inverse]
+
+
+def get_edge_table(options):
+    if getattr(options, "edge_table", None) is None:
+        options.edge_table = EdgeTable(options.net, options)
+    return options.edge_table
+
+
+def _normalize_angles(a, lower, upper, circle):
+    # vectorized sumolib.geomhelper.normalizeAngle
+    while (a < lower).any():
+        a = np.where(a < lower, a + circle, a)
+    while (a > upper).any():
+        a = np.where(a > upper, a - circle, a)
+    return a
+
+
+class EdgeWeights:
+    """a weight_fun backed by a weight vector aligned with net._edges"""
+
+    def __init__(self, table, weights):
+        self.table = table
+        self.weights = weights
+
+    def __call__(self, edge):
+        return self.weights[self.table.index[edge.getID()]]
+
+
 def get_prob_fun(options, fringe_bonus, fringe_forbidden, max_length):
     # fringe_bonus None generates intermediate way points
-    randomProbs = defaultdict(lambda: 1)
+    table = get_edge_table(options)
     if options.randomFactor != 1:
-        for edge in options.net.getEdges():
-            randomProbs[edge.getID()] = random.uniform(1, options.randomFactor)
-
-    roundabouts = set()
-    if not options.allowRoundabouts:
-        for roundabout in options.net.getRoundabouts():
-            roundabouts.update(roundabout.getEdges())
+        prob = np.array([random.uniform(1, options.randomFactor) for _ in options.net.getEdges()])
+    else:
+        prob = np.ones(len(table))
 
-    stopDict = None
+    stopCounts = None
     if options.fromStops and fringe_bonus == "_incoming":
-        stopDict = options.edgeFromStops
+        stopCounts = get_stop_index(options, options.fromStops).counts
     elif options.toStops and fringe_bonus == "_outgoing":
-        stopDict = options.edgeToStops
+        stopCounts = get_stop_index(options, options.toStops).counts
 
-    # IDEA: source and sink are not allowed as well, but that might also remove worthwile routes
-    def edge_probability(edge):
-        bonus_connections = None if fringe_bonus is None else getattr(edge, fringe_bonus)
-        forbidden_connections = None if fringe_forbidden is None else getattr(edge, fringe_forbidden)
-        if options.vclass and not edge.allows(options.vclass) and not stopDict:
-            return 0  # not allowed
-        if fringe_bonus is None and edge.is_fringe() and not options.pedestrians:
-            return 0  # not suitable as intermediate way point
-        if (fringe_forbidden is not None and
-                edge.is_fringe(forbidden_connections) and
-                not options.pedestrians and
-                (options.allow_fringe_min_length is None or edge.getLength() < options.allow_fringe_min_length)):
-            return 0  # the wrong kind of fringe
-        if (fringe_bonus is not None and options.viaEdgeTypes is not None and
-                not edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions) and
-                edge.getType() in options.viaEdgeTypes):
-            return 0  # the wrong type of edge (only allows depart and arrival on the fringe)
-        if fringe_bonus is not None and edge.getID() in roundabouts:
-            return 0  # traffic typically does not start/end inside a roundabout
-        prob = randomProbs[edge.getID()]
-        if stopDict:
-            prob *= len(stopDict[edge.getID()])
-        if options.length:
-            if (options.fringe_factor != 1.0 and fringe_bonus is not None and
-                    edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions)):
-                # short fringe edges should not suffer a penalty
-                prob *= max_length
-            else:
-                prob *= edge.getLength()
-        if options.lanes:
-            prob *= edge.getLaneNumber()
-        if edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions):
-            prob *= (edge.getSpeed() ** options.fringe_speed_exponent)
-        else:
-            prob *= (edge.getSpeed() ** options.speed_exponent)
-        if options.fringe_factor != 1.0 and fringe_bonus is not None:
-            isFringe = (edge.getSpeed() > options.fringe_threshold and
-                        edge.is_fringe(bonus_connections, checkJunctions=options.fringeJunctions))
-            if isFringe and options.fringe_factor != MAXIMIZE_FACTOR:
-                prob *= options.fringe_factor
-            elif not isFringe and options.fringe_factor == MAXIMIZE_FACTOR:
-                prob = 0
-        if options.edgeParam is not None:
-            prob *= float(edge.getParam(options.edgeParam, 1.0))
-        if options.angle_weight != 1.0 and fringe_bonus is not None:
-            xmin, ymin, xmax, ymax = edge.getBoundingBox()
-            ex, ey = ((xmin + xmax) / 2, (ymin + ymax) / 2)
-            nx, ny = options.angle_center
-            edgeAngle = naviDegree(math.atan2(ey - ny, ex - nx))
-            angleDiff = minAngleDegreeDiff(options.angle, edgeAngle)
-            # print("e=%s nc=%s ec=%s ea=%s a=%s ad=%s" % (
-            #    edge.getID(), options.angle_center, (ex,ey), edgeAngle,
-            #    options.angle, angleDiff))
-            # relDist = 2 * euclidean((ex, ey), options.angle_center) / max(xmax - xmin, ymax - ymin)
-            # prob *= (relDist * (options.angle_weight - 1) + 1)
-            if fringe_bonus == "_incoming":
-                # source edge
-                prob *= (angleDiff * (options.angle_weight - 1) + 1)
-            else:
-                prob *= ((180 - angleDiff) * (options.angle_weight - 1) + 1)
+    if fringe_bonus == "_incoming":
+        bonus_fringe = table.fringe_junction_incoming
+    elif fringe_bonus == "_outgoing":
+        bonus_fringe = table.fringe_junction_outgoing
+    else:
+        bonus_fringe = table.fringe_junction_incoming | table.fringe_junction_outgoing
 
-        return prob
-    return edge_probability
+    # the factors are applied in the same order as for a single edge to obtain identical weights
+    if stopCounts is not None:
+        prob *= stopCounts
+    if options.length:
+        if options.fringe_factor != 1.0 and fringe_bonus is not None:
+            # short fringe edges should not suffer a penalty
+            prob *= np.where(bonus_fringe, max_length, table.length)
+        else:
+            prob *= table.length
+    if options.lanes:
+        prob *= table.lanes
+    prob *= np.where(bonus_fringe,
+                     table.power(table.speed, options.fringe_speed_exponent),
+                     table.power(table.speed, options.speed_exponent))
+    if options.fringe_factor != 1.0 and fringe_bonus is not None:
+        isFringe = (table.speed > options.fringe_threshold) & bonus_fringe
+        if options.fringe_factor != MAXIMIZE_FACTOR:
+            prob *= np.where(isFringe, options.fringe_factor, 1.0)
+        else:
+            prob[~isFringe] = 0
+    if options.edgeParam is not None:
+        prob *= table.param(options.edgeParam, options.net._edges)
+    if options.angle_weight != 1.0 and fringe_bonus is not None:
+        angleDiff = np.minimum(_normalize_angles(options.angle - table.angle, 0, 360, 360),
+                               _normalize_angles(table.angle - options.angle, 0, 360, 360))
+        if fringe_bonus == "_incoming":
+            # source edge
+            prob *= (angleDiff * (options.angle_weight - 1) + 1)
+        else:
+            prob *= ((180 - angleDiff) * (options.angle_weight - 1) + 1)
 
+    # IDEA: source and sink are not allowed as well, but that might also remove worthwile routes
+    if options.vclass and stopCounts is None:
+        prob[~table.allowed] = 0  # not allowed
+    if not options.pedestrians:
+        if fringe_bonus is None:
+            prob[table.fringe] = 0  # not suitable as intermediate way point
+        if fringe_forbidden is not None:
+            # the wrong kind of fringe
+            forbidden = table.fringe_incoming if fringe_forbidden == "_incoming" else table.fringe_outgoing
+            if options.allow_fringe_min_length is not None:
+                forbidden = forbidden & (table.length < options.allow_fringe_min_length)
+            prob[forbidden] = 0
+    if fringe_bonus is not None and options.viaEdgeTypes is not None:
+        # the wrong type of edge (only allows depart and arrival on the fringe)
+        viaType = np.array([t in options.viaEdgeTypes for t in table.type], dtype=bool)
+        prob[viaType & ~bonus_fringe] = 0
+    if fringe_bonus is not None and not options.allowRoundabouts:
+        prob[table.roundabout] = 0  # traffic typically does not start/end inside a roundabout
+
+    return EdgeWeights(table, prob)
+
+
+def read_weights(fname):
+    """returns the edge ids and the values of a weights file as edgedata xml, npz or parquet"""
+    if fname.endswith(".npz"):
+        with np.load(fname) as data:
+            return data["id"].tolist(), data["value"]
+    if fname.endswith(".parquet"):
+        pyarrow = import_pyarrow("Reading Parquet weights")
+        table = pyarrow.parquet.read_table(fname, columns=["id", "value"])
+        return table.column("id").to_pylist(), table.column("value").to_numpy()
+    ids = []
+    values = []
+    for edge in sumolib.output.parse_fast(fname, 'edge', ['id', 'value']):
+        ids.append(edge.id)
+        values.append(float(edge.value))
+    return ids, np.array(values, dtype=float)
+
+
+def dense_weights(table, ids, values):
+    index = np.array([table.index.get(edgeID, -1) for edgeID in ids], dtype=np.int64)
+    known = index >= 0
+    weights = np.zeros(len(table))
+    weights[index[known]] = np.asarray(values, dtype=float)[known]
+    return weights
+
+
+def read_weight_intervals(fname, table):
+    """returns (begin, end, weights) for each interval of an edgedata xml file with several intervals
+       or a npz or parquet file with begin and end columns, an empty list otherwise"""
+    if fname.endswith(".npz") or fname.endswith(".parquet"):
+        if fname.endswith(".npz"):
+            with np.load(fname) as data:
+                if "begin" not in data:
+                    return []
+                columns = {k: data[k] for k in ("id", "value", "begin", "end")}
+        else:
+            pyarrow = import_pyarrow("Reading Parquet weights")
+            if "begin" not in pyarrow.parquet.read_schema(fname).names:
+                return []
+            columns = pyarrow.parquet.read_table(fname, columns=["id", "value", "begin", "end"]).to_pydict()
+            columns = {k: np.array(v) for k, v in columns.items()}
+        bounds = np.stack((columns["begin"], columns["end"]), axis=1)
+        intervals = []
+        for begin, end in np.unique(bounds, axis=0).tolist():
+            rows = (bounds[:, 0] == begin) & (bounds[:, 1] == end)
+            intervals.append((begin, end, dense_weights(table, columns["id"][rows].tolist(), columns["value"][rows])))
+        return intervals
+    with open(fname) as f:
+        if sum(1 for line in f if "<interval" in line) < 2:
+            return []
+    intervals = []
+    for interval in sumolib.xml.parse(fname, 'interval'):
+        edges = interval.getChild('edge') if interval.hasChild('edge') else []
+        weights = dense_weights(table, [e.id for e in edges], [float(e.value) for e in edges])
+        intervals.append((parseTime(interval.begin), parseTime(interval.end), weights))
+    return intervals
+
+
+def load_weights(fname, table, cache=False):
+    """returns the weights of the file as vector aligned with the edge table (0 for edges not in the file),
+       optionally through a cache file keyed by the content of the weights file and the edge order"""
+    if cache:
+        cachefile = fname + WEIGHTS_CACHE_SUFFIX
+        key = "%s %s" % (file_hash(fname), hashlib.sha1("\n".join(table.ids).encode("utf8")).hexdigest())
+        if os.path.isfile(cachefile):
+            try:
+                with np.load(cachefile) as data:
+                    if str(data["key"]) == key:
+                        return data["weights"]
+            except Exception as e:
+                print("Warning: could not read weights cache '%s' (%s)" % (cachefile, e), file=sys.stderr)
+
+    weights = dense_weights(table, *read_weights(fname))
+
+    if cache:
+        # write to a temporary file first because other processes may read the cache concurrently
+        tmpfile = "%s.%s.tmp" % (cachefile, os.getpid())
+        with open(tmpfile, "wb") as f:
+            np.savez(f, key=key, weights=weights)
+        os.replace(tmpfile, cachefile)
+    return weights
+
+
+class IntervalWeights:
+    """changes the weights of the source, sink and via generators for each departure interval,
+       either from weights files with several intervals or by drawing new random factors"""
+
+    GENERATORS = ("source_generator", "sink_generator", "via_generator")
+
+    def __init__(self, options):
+        self.options = options
+        self.times = get_interval_times(options)
+        self.begins = [parseTime(t) for t in self.times[:-1]]
+        # the random factors of an interval only depend on the seed so that all --jobs agree on them
+        self.entropy = np.random.SeedSequence(None if options.random else options.seed).entropy
+        self.intervals = {}
+        self.perturbed = {}
+        self.current = None
+
+    def __bool__(self):
+        return bool(self.intervals or self.perturbed)
+
+    def add_intervals(self, name, intervals, base):
+        """base are the weights for departure intervals which are not covered by the intervals"""
+        self.intervals[name] = (intervals, base)
+
+    def add_perturbation(self, name, base, initial):
+        """base are the weights without random factor, initial the ones of the first interval"""
+        self.perturbed[name] = (base, initial)
+
+    def get_weights(self, name, i):
+        if name in self.intervals:
+            intervals, base = self.intervals[name]
+            for begin, end, weights in intervals:
+                if begin <= self.begins[i] < end:
+                    return weights
+            return base
+        base, initial = self.perturbed[name]
+        if i == 0:
+            return initial
+        rng = np.random.default_rng([self.entropy, i, self.GENERATORS.index(name)])
+        return base * rng.uniform(1, self.options.randomFactor, len(base))
+
+    def apply(self, trip_generator, i):
+        """sets the weights for departure interval i"""
+        if i == self.current:
+            return
+        self.current = i
+        for name in self.GENERATORS:
+            generator = getattr(trip_generator, name)
+            if generator is None or (name not in self.intervals and name not in self.perturbed):
+                continue
+            weights = self.get_weights(name, i)
+            if np.array_equal(weights, generator.weights):
+                continue
+            try:
+                generator.update_weights(weights)
+            except InvalidGenerator:
+                print("Warning: no valid edges for the %s in interval %s, keeping the previous weights" % (
+                    name.split("_")[0], i), file=sys.stderr)
+                continue
+            if name == "sink_generator" and trip_generator.sink_sampler is not None:
+                trip_generator.use_spatial_sinks(self.options.min_distance, self.options.max_distance)
+            if name != "via_generator" and trip_generator.od_sampler is not None:
+                try:
+                    trip_generator.od_sampler.set_weights(trip_generator.source_generator.weights,
+                                                          trip_generator.sink_generator.weights)
+                except InvalidGenerator:
+                    print("Warning: no OD pair with valid edges in interval %s, keeping the previous weights" % i,
+                          file=sys.stderr)
+
+    def get_intervals(self, name):
+        """returns (begin, end, weights) for each departure interval or None if the weights of name do not change"""
+        if name not in self.intervals and name not in self.perturbed:
+            return None
+        return [(self.times[i], self.times[i + 1], self.get_weights(name, i)) for i in range(len(self.begins))]
 
-class LoadedProps:
 
-    def __init__(self, fname):
-        self.weights = defaultdict(lambda: 0)
-        for edge in sumolib.output.parse_fast(fname, 'edge', ['id', 'value']):
-            self.weights[edge.id] = float(edge.value)
+class LoadedProps(EdgeWeights):
+    """edge weights loaded from a weights file"""
 
-    def __call__(self, edge):
-        return self.weights[edge.getID()]
+    def __init__(self, fname, table, cache=False):
+        EdgeWeights.__init__(self, table, load_weights(fname, table, cache))
 
 
 def buildTripGenerator(net, options):
     try:
-        max_length = 0
-        for edge in net.getEdges():
-            if not edge.is_fringe():
-                max_length = max(max_length, edge.getLength())
+        table = get_edge_table(options)
+        max_length = float(table.length[~table.fringe].max(initial=0))
         forbidden_source_fringe = None if options.allow_fringe else "_outgoing"
         forbidden_sink_fringe = None if options.allow_fringe else "_incoming"
         source_generator = RandomEdgeGenerator(
@@ -537,12 +1743,12 @@ def buildTripGenerator(net, options):
         sink_generator = RandomEdgeGenerator(
             net, get_prob_fun(options, "_outgoing", forbidden_sink_fringe, max_length))
         if options.weightsprefix:
-            if os.path.isfile(options.weightsprefix + SOURCE_SUFFIX):
-                source_generator = RandomEdgeGenerator(
-                    net, LoadedProps(options.weightsprefix + SOURCE_SUFFIX))
-            if os.path.isfile(options.weightsprefix + DEST_SUFFIX):
-                sink_generator = RandomEdgeGenerator(
-                    net, LoadedProps(options.weightsprefix + DEST_SUFFIX))
+            if find_weights(options.weightsprefix, SOURCE_SUFFIX):
+                source_generator = RandomEdgeGenerator(net, LoadedProps(
+                    find_weights(options.weightsprefix, SOURCE_SUFFIX), table, options.weightsCache))
+            if find_weights(options.weightsprefix, DEST_SUFFIX):
+                sink_generator = RandomEdgeGenerator(net, LoadedProps(
+                    find_weights(options.weightsprefix, DEST_SUFFIX), table, options.weightsCache))
     except InvalidGenerator:
         print("Error: no valid edges for generating source or destination. Try using option --allow-fringe",
               file=sys.stderr)
@@ -551,9 +1757,9 @@ def buildTripGenerator(net, options):
     try:
         via_generator = RandomEdgeGenerator(
             net, get_prob_fun(options, None, None, 1))
-        if options.weightsprefix and os.path.isfile(options.weightsprefix + VIA_SUFFIX):
-            via_generator = RandomEdgeGenerator(
-                net, LoadedProps(options.weightsprefix + VIA_SUFFIX))
+        if options.weightsprefix and find_weights(options.weightsprefix, VIA_SUFFIX):
+            via_generator = RandomEdgeGenerator(net, LoadedProps(
+                find_weights(options.weightsprefix, VIA_SUFFIX), get_edge_table(options), options.weightsCache))
     except InvalidGenerator:
         if options.intermediate > 0:
             print("Error: no valid edges for generating intermediate points", file=sys.stderr)
@@ -561,8 +1767,83 @@ def buildTripGenerator(net, options):
         else:
             via_generator = None
 
-    return RandomTripGenerator(
+    trip_generator = RandomTripGenerator(
         source_generator, sink_generator, via_generator, options.intermediate, options.pedestrians)
+    build_interval_weights(options, trip_generator, forbidden_source_fringe, forbidden_sink_fringe, max_length)
+    if options.odMatrix and not build_zone_od(options, trip_generator):
+        return None
+    if options.spatialSinks:
+        if options.intermediate > 0:
+            print("Warning: Option --spatial-sinks is ignored for trips with intermediate edges", file=sys.stderr)
+        else:
+            trip_generator.use_spatial_sinks(options.min_distance, options.max_distance)
+    if options.checkReachability:
+        if options.pedestrians or options.junctionTaz:
+            print("Warning: Option --check-reachability is ignored for pedestrians and junction trips",
+                  file=sys.stderr)
+        else:
+            trip_generator.reachability = Reachability(net, options.vehicle_class or options.vclass)
+    return trip_generator
+
+
+def build_zone_od(options, trip_generator):
+    """assigns the edges to the zones and sets up drawing by OD matrix, returns False if no trips are possible"""
+    zone_ids, shapes = read_zones(options.zones, options.net)
+    from_xy, to_xy = trip_generator._get_edge_arrays()[:2]
+    midpoint = (from_xy + to_xy) / 2
+    zone_of_edge = np.full(len(midpoint), -1, dtype=np.int64)
+    for z, shape in enumerate(shapes):
+        candidates = np.flatnonzero((zone_of_edge < 0) & (midpoint >= shape.min(axis=0)).all(axis=1)
+                                    & (midpoint <= shape.max(axis=0)).all(axis=1))
+        zone_of_edge[candidates[points_in_polygon(midpoint[candidates], shape)]] = z
+    index = {zone: z for z, zone in enumerate(zone_ids)}
+    pairs = []
+    unknown = set()
+    for origin, destination, number in read_od_matrix(options.odMatrix):
+        if origin in index and destination in index:
+            pairs.append((index[origin], index[destination], number))
+        else:
+            unknown.update(zone for zone in (origin, destination) if zone not in index)
+    if unknown:
+        print("Warning: zones %s of the OD matrix are not defined in '%s'" % (
+            ", ".join(sorted(unknown)), options.zones), file=sys.stderr)
+    try:
+        trip_generator.use_od_matrix(zone_of_edge, len(zone_ids), pairs)
+    except InvalidGenerator:
+        print("Error: no OD pair has valid source and destination edges within its zones", file=sys.stderr)
+        return False
+    if trip_generator.od_sampler.dropped > 0:
+        print("Warning: dropping %s trips of the OD matrix between zones without valid edges" %
+              intIfPossible(trip_generator.od_sampler.dropped), file=sys.stderr)
+    return True
+
+
+def build_interval_weights(options, trip_generator, forbidden_source_fringe, forbidden_sink_fringe, max_length):
+    """sets up the weights which change with the departure interval"""
+    interval_weights = IntervalWeights(options)
+    table = get_edge_table(options)
+    unperturbed = copy.copy(options)
+    unperturbed.randomFactor = 1
+    for name, suffix, prob_args in (
+            ("source_generator", SOURCE_SUFFIX, ("_incoming", forbidden_source_fringe, max_length)),
+            ("sink_generator", DEST_SUFFIX, ("_outgoing", forbidden_sink_fringe, max_length)),
+            ("via_generator", VIA_SUFFIX, (None, None, 1))):
+        generator = getattr(trip_generator, name)
+        if generator is None:
+            continue
+        fname = find_weights(options.weightsprefix, suffix) if options.weightsprefix else None
+        if fname:
+            intervals = read_weight_intervals(fname, table)
+            if intervals:
+                # outside of the intervals of the file, the weights derived from the network apply
+                interval_weights.add_intervals(name, intervals, get_prob_fun(unperturbed, *prob_args).weights)
+        elif options.randomFactorPerInterval and options.randomFactor != 1:
+            interval_weights.add_perturbation(name, get_prob_fun(unperturbed, *prob_args).weights, generator.weights)
+    if interval_weights:
+        if options.flows > 0:
+            print("Warning: Flows keep their origin and destination for all intervals", file=sys.stderr)
+        else:
+            trip_generator.interval_weights = interval_weights
 
 
 def is_walk_attribute(attr):
@@ -652,7 +1933,14 @@ def samplePosition(edge):
     return random.uniform(0.0, edge.getLength())
 
 
-def main(options):
+# a sampled trip; for option --flows it describes one flow within the interval [depart, arrival)
+Trip = namedtuple("Trip", ["id", "depart", "arrival", "period", "origin", "destination", "intermediate",
+                           "interval"])
+
+
+def init_generation(options):
+    """seeds the random number generator and builds the trip generator,
+       returns None if no trips can be generated with the given options"""
     if not options.random:
         random.seed(options.seed)
 
@@ -666,23 +1954,476 @@ def main(options):
         xmin, ymin, xmax, ymax = options.net.getBoundary()
         options.angle_center = (xmin + xmax) / 2, (ymin + ymax) / 2
 
-    trip_generator = buildTripGenerator(options.net, options)
+    return buildTripGenerator(options.net, options)
+
+
+def get_interval_times(options):
+    time_delta = (parseTime(options.end) - parseTime(options.begin)) / len(options.period)
+    times = [parseTime(options.begin) + i*time_delta for i in range(len(options.period)+1)]
+    return list(map(intIfPossible, times))
+
+
+def generate_origin_destination(trip_generator, options):
+    source_edge, sink_edge, intermediate = trip_generator.get_trip(
+        options.min_distance, options.max_distance, options.maxtries,
+        options.junctionTaz, options.min_dist_fringe)
+    return source_edge, sink_edge, intermediate
+
+
+def generate_origin_destinations(trip_generator, options, n):
+    trips = trip_generator.get_trips(
+        n, options.min_distance, options.max_distance, options.maxtries,
+        options.junctionTaz, options.min_dist_fringe, options.batchSize)
+    found = n - trips.count(None)
+    if found < n:
+        print("Warning: only %s of %s trips found after %s tries per trip" % (found, n, options.maxtries),
+              file=sys.stderr)
+    return trips
+
+
+def get_departures(options, departureTime, arrivalTime, period, rng=None):
+    """returns the sorted departure times within one interval,
+       the random schedules are drawn as arrays with the numpy generator from get_schedule_rng"""
+    if options.binomial is not None or options.randomDepart:
+        return get_departures_vectorized(options, departureTime, arrivalTime, period, rng)
+    departures = []
+    while departureTime < arrivalTime:
+        departures.append(departureTime)
+        departureTime += period
+    return departures
+
+
+def get_departures_vectorized(options, departureTime, arrivalTime, period, rng):
+    if options.binomial is None:
+        # one uniform departure per period
+        n = max(0, int(math.ceil((arrivalTime - departureTime) / period)))
+        departures = rng.integers(int(departureTime), int(arrivalTime), n).astype(float)
+        subsecond = math.fmod(period, 1)
+        if subsecond != 0:
+            # allow all multiples of subsecond to appear
+            rSubSecond = np.fmod(subsecond * rng.integers(int(departureTime), int(arrivalTime), n), 1)
+            departures = np.minimum(arrivalTime, departures + rSubSecond)
+        departures.sort()
+    else:
+        # the number of successes of n Bernoulli draws per second is binomially distributed
+        seconds = departureTime + np.arange(max(0, int(math.ceil(arrivalTime - departureTime))))
+        prob = min(1.0, 1.0 / period / options.binomial)
+        departures = np.repeat(seconds, rng.binomial(options.binomial, prob, len(seconds)))
+    return departures.tolist()
+
+
+def get_schedule_rng(options):
+    """returns the generator for drawing random schedules as arrays or None if the schedule is not random.
+       It is seeded from the global random sequence, so the schedule only depends on --seed."""
+    if options.binomial is not None or options.randomDepart:
+        return np.random.default_rng(random.getrandbits(64))
+    return None
+
+
+def get_schedule(options, rng=None):
+    """returns (departure, arrival, period, interval) for all trips"""
+    times = get_interval_times(options)
+    schedule = []
+    for i in range(len(times)-1):
+        departureTime = parseTime(times[i])
+        arrivalTime = parseTime(times[i+1])
+        period = options.period[i]
+        schedule += [(time, arrivalTime, period, i)
+                     for time in get_departures(options, departureTime, arrivalTime, period, rng)]
+    return schedule
+
+
+def sample_departures(options, trip_generator, schedule, idx=0):
+    """yields a Trip for each (departure, arrival, period, interval) of the schedule
+       for which origin and destination could be found, numbered from idx"""
+    if trip_generator.interval_weights is not None:
+        # sample each interval with its own weights
+        for i, departures in itertools.groupby(schedule, key=lambda departure: departure[3]):
+            trip_generator.interval_weights.apply(trip_generator, i)
+            for trip in _sample_departures(options, trip_generator, list(departures), idx):
+                yield trip
+                idx += 1
+    else:
+        for trip in _sample_departures(options, trip_generator, schedule, idx):
+            yield trip
+
+
+def _sample_departures(options, trip_generator, schedule, idx):
+    if options.batchSize > 0:
+        trips = generate_origin_destinations(trip_generator, options, len(schedule))
+        for (time, arrivalTime, period, i), trip in zip(schedule, trips):
+            # the departures of failed slots are dropped as in the loop below
+            if trip is None:
+                continue
+            origin, destination, intermediate = trip
+            yield Trip(idx, time, arrivalTime, period, origin, destination, intermediate, i)
+            idx += 1
+        return
+
+    for time, arrivalTime, period, i in schedule:
+        # generate with constant spacing
+        try:
+            origin, destination, intermediate = generate_origin_destination(trip_generator, options)
+        except Exception as exc:
+            # failures within binomial schedules are only reported with --verbose as before
+            if options.verbose or options.binomial is None:
+                print(exc, file=sys.stderr)
+            continue
+        yield Trip(idx, time, arrivalTime, period, origin, destination, intermediate, i)
+        idx += 1
+
+
+def sample_trips(options, trip_generator):
+    """yields a Trip for every vehicle or person (or every flow if option --flows is set) in the order of departure.
+       Trips are sampled lazily, so the consumer may draw random numbers in between."""
+    times = get_interval_times(options)
     idx = 0
+    if options.flows == 0:
+        rng = get_schedule_rng(options)
+        for i in range(len(times)-1):
+            departureTime = parseTime(times[i])
+            arrivalTime = parseTime(times[i+1])
+            period = options.period[i]
+            schedule = [(t, arrivalTime, period, i)
+                        for t in get_departures(options, departureTime, arrivalTime, period, rng)]
+            for trip in sample_departures(options, trip_generator, schedule, idx):
+                yield trip
+                idx += 1
+    else:
+        try:
+            origins_destinations = [generate_origin_destination(
+                trip_generator, options) for _ in range(options.flows)]
+        except Exception as exc:
+            if options.verbose:
+                print(exc, file=sys.stderr)
+            return
+        for i in range(len(times)-1):
+            for j in range(options.flows):
+                origin, destination, intermediate = origins_destinations[j]
+                yield Trip(j, times[i], times[i+1], options.period[i], origin, destination, intermediate, i)
+
+
+def _bind_options(options, net):
+    # copy the options because generating trips modifies some of them
+    options = copy.copy(options)
+    if net is not None:
+        set_net(options, net)
+    return options
+
+
+def iter_trips(options, net=None):
+    """Generates trips in-process and yields them as Trip records without writing or routing anything.
+       The options (see get_options) are not modified and may be reused for further calls.
+       If net is given, it replaces the network the options were created with."""
+    options = _bind_options(options, net)
+    trip_generator = init_generation(options)
+    if trip_generator is None:
+        raise InvalidGenerator()
+    for trip in sample_trips(options, trip_generator):
+        yield trip
+
+
+def iter_trip_batches(options, net=None, size=10000):
+    """Like iter_trips but yields structured numpy arrays of up to size trips.
+       Edges are given as indices into net._edges, intermediate edges in the column 'via'."""
+    options = _bind_options(options, net)
+    trip_generator = init_generation(options)
+    if trip_generator is None:
+        raise InvalidGenerator()
+    index = get_edge_table(options).index
+    dtype = [("id", np.int64), ("depart", float), ("arrival", float), ("interval", np.int32),
+             ("origin", np.int32), ("destination", np.int32)]
+    if options.intermediate > 0:
+        dtype.append(("via", np.int32, (options.intermediate,)))
+
+    batch = []
+    for trip in sample_trips(options, trip_generator):
+        record = (trip.id, trip.depart, trip.arrival, trip.interval,
+                  index[trip.origin.getID()], index[trip.destination.getID()])
+        if options.intermediate > 0:
+            record += ([index[e.getID()] for e in trip.intermediate],)
+        batch.append(record)
+        if len(batch) == size:
+            yield np.array(batch, dtype=dtype)
+            batch = []
+    if batch:
+        yield np.array(batch, dtype=dtype)
+
+
+def open_output(fname):
+    """opens a text file for writing, gzip compressed if the name ends with .gz"""
+    if fname.endswith(".gz"):
+        # the default level 9 is much slower while hardly compressing trip files any better
+        return gzip.open(fname, "wt", encoding="utf8", compresslevel=6)
+    return open(fname, "w", buffering=OUTPUT_BUFFER_SIZE)
+
+
+def temporary_name(fname):
+    # keep the .gz suffix so that SUMO applications still compress their output
+    if fname.endswith(".gz"):
+        return fname[:-3] + ".tmp.gz"
+    return fname + ".tmp"
+
+
+def part_name(fname, k):
+    # the parts of a Parquet table must be Parquet files as well
+    if fname.endswith(".parquet"):
+        return "%s.part%s.parquet" % (fname[:-8], k)
+    return "%s.part%s" % (fname, k)
+
+
+class TripWriter:
+    """collects the many small writes for the trip elements and passes them on in large chunks"""
+
+    def __init__(self, fname):
+        self.out = open_output(fname)
+        self.parts = []
+        self.size = 0
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= OUTPUT_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.out.write("".join(self.parts))
+        self.parts = []
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TableWriter:
+    """writes rows as CSV or as Parquet (requires pyarrow), COLUMNS holds the names and Parquet types"""
+
+    COLUMNS = []
+
+    def __init__(self, fname, header=True):
+        self.rows = []
+        self.parquet = fname.endswith(".parquet")
+        if self.parquet:
+            pyarrow = import_pyarrow("Writing a Parquet table")
+            self.pa = pyarrow
+            self.schema = pyarrow.schema([(name, getattr(pyarrow, dtype)()) for name, dtype in self.COLUMNS])
+            self.writer = pyarrow.parquet.ParquetWriter(fname, self.schema)
+        else:
+            self.out = open_output(fname)
+            self.writer = csv.writer(self.out)
+            if header:
+                self.writer.writerow([name for name, _ in self.COLUMNS])
+
+    def add_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= 100000:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.parquet:
+            columns = list(zip(*self.rows))
+            self.writer.write_table(self.pa.Table.from_arrays(
+                [self.pa.array(c, type=f.type) for c, f in zip(columns, self.schema)], schema=self.schema))
+        else:
+            self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.out.close()
+
+    def append(self, fname):
+        """appends the rows of a table part written with header=False"""
+        self.flush()
+        if self.parquet:
+            for batch in self.pa.parquet.ParquetFile(fname).iter_batches():
+                self.writer.write_table(self.pa.Table.from_batches([batch], schema=self.schema))
+        else:
+            with open(fname) as part:
+                shutil.copyfileobj(part, self.out)
+
+
+class TripTableWriter(TableWriter):
+    """writes the trips as table with one row per trip"""
+
+    COLUMNS = [("id", "string"), ("depart", "float64"), ("from", "string"), ("to", "string"),
+               ("via", "string"), ("interval", "int32")]
+
+    def __init__(self, fname, prefix="", header=True):
+        self.prefix = prefix
+        TableWriter.__init__(self, fname, header)
+
+    def add(self, trip):
+        self.add_row(("%s%s" % (self.prefix, trip.id), trip.depart, trip.origin.getID(),
+                      trip.destination.getID(), " ".join(e.getID() for e in trip.intermediate), trip.interval))
+
+
+class ODTableWriter(TableWriter):
+    """writes the number of trips per interval, origin, destination and via edges"""
+
+    COLUMNS = [("interval", "int32"), ("begin", "float64"), ("end", "float64"), ("from", "string"),
+               ("to", "string"), ("via", "string"), ("count", "int64")]
+
+    def add(self, interval, begin, end, origin, destination, intermediate, count):
+        self.add_row((interval, begin, end, origin.getID(), destination.getID(),
+                      " ".join(e.getID() for e in intermediate), count))
+
+
+ELEMENT_ID = re.compile(r'^\s*<(?:vehicle|trip|flow|person|personFlow) id="([^"]*)"')
+
+
+def open_input(fname):
+    if fname.endswith(".gz"):
+        return gzip.open(fname, "rt", encoding="utf8")
+    return open(fname)
+
+
+def filter_routed_trips(tripfile, routefile, flows=False):
+    """removes the trips and persons (or flows) which did not make it into the route file,
+       relies on the one line per opening tag format of the trip file written by main"""
+    with open_input(routefile) as routes:
+        routed = set(m.group(1) for m in map(ELEMENT_ID.match, routes) if m)
+    if flows:
+        # duarouter writes the vehicles of a flow with ids 'flowID.index'
+        routed = set(vehID.rsplit(".", 1)[0] for vehID in routed)
+    tmpTrips = temporary_name(tripfile)
+    with open_input(tripfile) as trips, TripWriter(tmpTrips) as out:
+        skip = False
+        for line in trips:
+            if skip:
+                # the children of a dropped element are self-closing, the next closing tag is its own
+                skip = not line.lstrip().startswith("</")
+                continue
+            m = ELEMENT_ID.match(line)
+            if m and m.group(1) not in routed:
+                skip = not line.rstrip().endswith("/>")
+                continue
+            out.write(line)
+    os.remove(tripfile)  # on windows, rename does not overwrite
+    os.rename(tmpTrips, tripfile)
+    return len(routed)
+
+
+class Profile:
+    """records wall time, CPU time (own and of child processes) and peak memory for the phases of a run"""
+
+    def __init__(self):
+        self.phases = {}
+        self.stats = Counter()
+
+    @staticmethod
+    def _now():
+        if resource is None:
+            return perf_counter(), process_time(), 0.
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return perf_counter(), process_time(), children.ru_utime + children.ru_stime
+
+    @staticmethod
+    def _peak_rss():
+        """peak resident set size in MB of this process and of the largest child process"""
+        if resource is None:
+            return None, None
+        # ru_maxrss is given in kilobytes on linux and in bytes on macOS
+        scale = 1 << 20 if sys.platform == "darwin" else 1 << 10
+        return tuple(resource.getrusage(who).ru_maxrss / scale
+                     for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+    def add(self, name, wall, cpu, cpu_children=0.):
+        phase = self.phases.setdefault(name, {"wall": 0., "cpu": 0., "cpu_children": 0.})
+        phase["wall"] += wall
+        phase["cpu"] += cpu
+        phase["cpu_children"] += cpu_children
+        phase["process_peak_rss_mb"], phase["process_peak_rss_children_mb"] = self._peak_rss()
+
+    @contextlib.contextmanager
+    def phase(self, name, exclude=None):
+        """times the enclosed block, the time recorded meanwhile for the phase exclude is subtracted"""
+        start = self._now()
+        excluded = dict(self.phases.get(exclude, {"wall": 0., "cpu": 0.}))
+        try:
+            yield
+        finally:
+            end = self._now()
+            wall, cpu, cpu_children = [b - a for a, b in zip(start, end)]
+            if exclude in self.phases:
+                wall -= self.phases[exclude]["wall"] - excluded["wall"]
+                cpu -= self.phases[exclude]["cpu"] - excluded["cpu"]
+            self.add(name, wall, cpu, cpu_children)
+
+    @staticmethod
+    def phase_of(options, name, exclude=None):
+        """the phase of the profiler in options or a no-op if the run is not profiled"""
+        if options.profiler is None:
+            return contextlib.nullcontext()
+        return options.profiler.phase(name, exclude)
+
+    def timed(self, name, iterable):
+        """yields from iterable and records the time spent producing the items as phase name.
+           Only the wall time is taken per item, the CPU time of the whole iteration is attributed
+           in proportion to it and the memory is sampled once at the end"""
+        iterator = iter(iterable)
+        end = object()
+        wall = 0.
+        start_wall, start_cpu = perf_counter(), process_time()
+        try:
+            while True:
+                t = perf_counter()
+                item = next(iterator, end)
+                wall += perf_counter() - t
+                if item is end:
+                    return
+                yield item
+        finally:
+            total = perf_counter() - start_wall
+            self.add(name, wall, (process_time() - start_cpu) * (wall / total if total > 0 else 1.))
+
+    def write(self, fname):
+        stats = dict(self.stats)
+        trips = stats.get("trips", 0)
+        sampling = {
+            "candidates": stats.pop("candidates", 0),
+            "trips": stats.pop("trips", 0),
+            "failed": stats.pop("failed", 0),
+            "surplus": stats.pop("surplus", 0),
+            "rejected": stats,
+        }
+        sampling["candidates_per_trip"] = sampling["candidates"] / trips if trips else None
+        with open(fname, "w") as f:
+            json.dump({"phases": self.phases, "sampling": sampling}, f, indent=2)
+
+
+def main(options):
+    if options.profile and options.profiler is None:
+        # the options were not created by get_options
+        options.profiler = Profile()
+    with Profile.phase_of(options, "generators"):
+        trip_generator = init_generation(options)
+    if trip_generator and options.profiler is not None:
+        trip_generator.stats = options.profiler.stats
 
     vtypeattrs, options.tripattrs, personattrs, otherattrs = split_trip_attributes(
         options.tripattrs, options.pedestrians, options.vehicle_class, options.verbose)
 
     vias = {}
-
-    time_delta = (parseTime(options.end) - parseTime(options.begin)) / len(options.period)
-    times = [parseTime(options.begin) + i*time_delta for i in range(len(options.period)+1)]
-    times = list(map(intIfPossible, times))
-
-    def generate_origin_destination(trip_generator, options):
-        source_edge, sink_edge, intermediate = trip_generator.get_trip(
-            options.min_distance, options.max_distance, options.maxtries,
-            options.junctionTaz, options.min_dist_fringe)
-        return source_edge, sink_edge, intermediate
+    if options.fromStops:
+        fromStopIndex = get_stop_index(options, options.fromStops)
+    if options.toStops:
+        toStopIndex = get_stop_index(options, options.toStops)
+    if options.fringeattrs:
+        startFringe = get_edge_table(options).fringe_junction_incoming
+        edgeIndex = get_edge_table(options).index
 
     def generate_attributes(idx, departureTime, arrivalTime, origin, destination, intermediate, options):
         label = "%s%s" % (options.tripprefix, idx)
@@ -693,8 +2434,7 @@ def main(options):
         if options.randomArrivalPos:
             randomPosition = samplePosition(destination)
             combined_attrs += ' arrivalPos="%.2f"' % randomPosition
-        if options.fringeattrs and origin.is_fringe(
-                origin._incoming, checkJunctions=options.fringeJunctions):
+        if options.fringeattrs and startFringe[edgeIndex[origin.getID()]]:
             combined_attrs += " " + options.fringeattrs
         if options.junctionTaz:
             attrFrom = ' fromJunction="%s"' % origin.getFromNode().getID()
@@ -703,9 +2443,9 @@ def main(options):
             attrFrom = ' from="%s"' % origin.getID()
             attrTo = ' to="%s"' % destination.getID()
         if options.fromStops:
-            attrFrom = ' %s="%s"' % random.choice(options.edgeFromStops[origin.getID()])
+            attrFrom = fromStopIndex.draw(origin.getID())
         if options.toStops:
-            attrTo = ' %s="%s"' % random.choice(options.edgeToStops[destination.getID()])
+            attrTo = toStopIndex.draw(destination.getID())
         via = ""
         if intermediate:
             via = ' via="%s" ' % ' '.join(
@@ -714,13 +2454,13 @@ def main(options):
                 vias[label] = via
         return label, combined_attrs, attrFrom, attrTo, via
 
-    def generate_one_person(label, combined_attrs, attrFrom, attrTo, departureTime, intermediate, options):
-        fouttrips.write(
+    def generate_one_person(out, label, combined_attrs, attrFrom, attrTo, departureTime, intermediate, options):
+        out.write(
             '    <person id="%s" depart="%.2f"%s>\n' % (label, departureTime, personattrs))
         element = "walk"
         attrs = otherattrs
         if options.fromStops:
-            fouttrips.write('        <stop%s duration="0"/>\n' % attrFrom)
+            out.write('        <stop%s duration="0"/>\n' % attrFrom)
             attrFrom = ''
         if options.persontrips:
             element = "personTrip"
@@ -728,37 +2468,38 @@ def main(options):
             element = "ride"
             attrs = ' lines="%s%s"' % (options.personrides, otherattrs)
         if intermediate:
-            fouttrips.write('        <%s%s to="%s"%s/>\n' % (element, attrFrom, intermediate[0].getID(), attrs))
+            out.write('        <%s%s to="%s"%s/>\n' % (element, attrFrom, intermediate[0].getID(), attrs))
             for edge in intermediate[1:]:
-                fouttrips.write('        <%s to="%s"%s/>\n' % (element, edge.getID(), attrs))
-            fouttrips.write('        <%s%s%s/>\n' % (element, attrTo, attrs))
+                out.write('        <%s to="%s"%s/>\n' % (element, edge.getID(), attrs))
+            out.write('        <%s%s%s/>\n' % (element, attrTo, attrs))
         else:
-            fouttrips.write('        <%s%s%s%s/>\n' % (element, attrFrom, attrTo, attrs))
-        fouttrips.write('    </person>\n')
+            out.write('        <%s%s%s%s/>\n' % (element, attrFrom, attrTo, attrs))
+        out.write('    </person>\n')
 
-    def generate_one_flow(label, combined_attrs, departureTime, arrivalTime, period, options, timeIdx):
+    def generate_one_flow(out, label, combined_attrs, departureTime, arrivalTime, period, options, timeIdx):
         if len(options.period) > 1:
             label = label + "#%s" % timeIdx
         if options.binomial:
             for j in range(options.binomial):
-                fouttrips.write(('    <flow id="%s#%s" begin="%s" end="%s" probability="%.2f"%s/>\n') % (
+                out.write(('    <flow id="%s#%s" begin="%s" end="%s" probability="%.2f"%s/>\n') % (
                     label, j, departureTime, arrivalTime, 1.0 / period / options.binomial,
                     combined_attrs))
         else:
-            fouttrips.write(('    <flow id="%s" begin="%s" end="%s" period="%s"%s/>\n') % (
+            out.write(('    <flow id="%s" begin="%s" end="%s" period="%s"%s/>\n') % (
                 label, departureTime, arrivalTime, intIfPossible(period * options.flows), combined_attrs))
 
-    def generate_one_trip(label, combined_attrs, departureTime):
-        fouttrips.write('    <trip id="%s" depart="%.2f"%s/>\n' % (
+    def generate_one_trip(out, label, combined_attrs, departureTime):
+        out.write('    <trip id="%s" depart="%.2f"%s/>\n' % (
             label, departureTime, combined_attrs))
 
-    def generate_one(idx, departureTime, arrivalTime, period, origin, destination, intermediate, timeIdx=None):
+    def generate_one(out, trip):
+        idx, departureTime, arrivalTime, period, origin, destination, intermediate, timeIdx = trip
         try:
             label, combined_attrs, attrFrom, attrTo, via = generate_attributes(
                 idx, departureTime, arrivalTime, origin, destination, intermediate, options)
 
             if options.pedestrians:
-                generate_one_person(label, combined_attrs, attrFrom, attrTo, departureTime, intermediate, options)
+                generate_one_person(out, label, combined_attrs, attrFrom, attrTo, departureTime, intermediate, options)
             else:
                 if options.jtrrouter:
                     attrTo = ''
@@ -766,17 +2507,100 @@ def main(options):
                 combined_attrs = attrFrom + attrTo + via + combined_attrs
 
                 if options.flows > 0:
-                    generate_one_flow(label, combined_attrs, departureTime, arrivalTime, period, options, timeIdx)
+                    generate_one_flow(out, label, combined_attrs, departureTime, arrivalTime, period, options, timeIdx)
                 else:
-                    generate_one_trip(label, combined_attrs, departureTime)
+                    generate_one_trip(out, label, combined_attrs, departureTime)
 
         except Exception as exc:
             if options.verbose:
                 print(exc, file=sys.stderr)
 
-        return idx + 1
+    def generate_part(schedule, idx, seed_sequence, tripfile, tablefile):
+        # runs in a forked worker process which shares the trip generator with the parent
+        trip_generator.seed(seed_sequence)
+        if trip_generator.stats is not None:
+            trip_generator.stats = Counter()
+        table = TripTableWriter(tablefile, options.tripprefix, header=False) if tablefile else None
+        with TripWriter(tripfile) as out:
+            for trip in sample_departures(options, trip_generator, schedule, idx):
+                generate_one(out, trip)
+                if table:
+                    table.add(trip)
+        if table:
+            table.close()
+        if trip_generator.stats is not None:
+            with open(tripfile + ".stats.json", "w") as f:
+                json.dump(trip_generator.stats, f)
+
+    def sampled_trips():
+        trips = sample_trips(options, trip_generator)
+        if options.profiler is None:
+            return trips
+        return options.profiler.timed("sampling", trips)
+
+    def generate_parallel(fouttrips, table):
+        # the schedule is drawn in the parent so that only the sampling depends on the number of jobs,
+        # trip ids are the indices into the schedule and thus stay unique across the chunks
+        schedule = get_schedule(options, get_schedule_rng(options))
+        bounds = [len(schedule) * k // options.jobs for k in range(options.jobs + 1)]
+        seeds = np.random.SeedSequence(None if options.random else options.seed).spawn(options.jobs)
+        parts = [part_name(options.tripfile, k) for k in range(options.jobs)]
+        tableParts = [part_name(options.tripTable, k) if table else None for k in range(options.jobs)]
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            print("Error: Option --jobs requires a platform which supports forking processes", file=sys.stderr)
+            sys.exit(1)
+        fouttrips.flush()
+        workers = [context.Process(target=generate_part, args=(
+            schedule[bounds[k]:bounds[k + 1]], bounds[k], seeds[k], parts[k], tableParts[k]))
+            for k in range(options.jobs)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [k for k, worker in enumerate(workers) if worker.exitcode != 0]
+        if failed:
+            print("Error: Generating the trips failed for chunks %s" % failed, file=sys.stderr)
+            sys.exit(1)
+        # merge in the order of the chunks to keep the trips sorted by departure
+        for k in range(options.jobs):
+            with open(parts[k]) as part:
+                shutil.copyfileobj(part, fouttrips)
+            os.remove(parts[k])
+            if trip_generator.stats is not None:
+                with open(parts[k] + ".stats.json") as f:
+                    trip_generator.stats.update(json.load(f))
+                os.remove(parts[k] + ".stats.json")
+            if table:
+                table.append(tableParts[k])
+                os.remove(tableParts[k])
+
+    def generate_aggregated(fouttrips, table):
+        counts = defaultdict(int)
+        for trip in sampled_trips():
+            if not options.aggregate:
+                generate_one(fouttrips, trip)
+            if table:
+                table.add(trip)
+            counts[(trip.interval, trip.origin, trip.destination, tuple(trip.intermediate))] += 1
+        # the trips arrive ordered by interval, so do the counts
+        times = get_interval_times(options)
+        if options.odTable:
+            odTable = ODTableWriter(options.odTable)
+            for (i, origin, destination, intermediate), number in counts.items():
+                odTable.add(i, times[i], times[i + 1], origin, destination, intermediate, number)
+            odTable.close()
+        if options.aggregate:
+            for idx, ((i, origin, destination, intermediate), number) in enumerate(counts.items()):
+                label, combined_attrs, attrFrom, attrTo, via = generate_attributes(
+                    idx, times[i], times[i + 1], origin, destination, list(intermediate), options)
+                if options.jtrrouter:
+                    attrTo = ''
+                fouttrips.write('    <flow id="%s" begin="%s" end="%s" number="%s"%s/>\n' % (
+                    label, times[i], times[i + 1], number, attrFrom + attrTo + via + combined_attrs))
 
-    with open(options.tripfile, 'w') as fouttrips:
+    with TripWriter(options.tripfile) as fouttrips:
         sumolib.writeXMLHeader(fouttrips, "$Id$", "routes", options=options)
         if options.vehicle_class:
             vTypeDef = '    <vType id="%s" vClass="%s"%s/>\n' % (
@@ -798,68 +2622,21 @@ def main(options):
             personattrs += ' type="%s"' % options.vtypeID
 
         if trip_generator:
-            if options.flows == 0:
-                for i in range(len(times)-1):
-                    time = departureTime = parseTime(times[i])
-                    arrivalTime = parseTime(times[i+1])
-                    period = options.period[i]
-                    if options.binomial is None:
-                        departures = []
-                        if options.randomDepart:
-                            subsecond = math.fmod(period, 1)
-                            while time < arrivalTime:
-                                rTime = random.randrange(int(departureTime), int(arrivalTime))
-                                time += period
-                                if subsecond != 0:
-                                    # allow all multiples of subsecond to appear
-                                    rSubSecond = math.fmod(
-                                        subsecond * random.randrange(int(departureTime), int(arrivalTime)), 1)
-                                    rTime = min(arrivalTime, rTime + rSubSecond)
-                                departures.append(rTime)
-                            departures.sort()
-                        else:
-                            while departureTime < arrivalTime:
-                                departures.append(departureTime)
-                                departureTime += period
-
-                        for time in departures:
-                            # generate with constant spacing
-                            try:
-                                origin, destination, intermediate = generate_origin_destination(trip_generator, options)
-                                idx = generate_one(idx, time, arrivalTime, period, origin, destination, intermediate)
-                            except Exception as exc:
-                                print(exc, file=sys.stderr)
-                    else:
-                        time = departureTime
-                        while time < arrivalTime:
-                            # draw n times from a Bernoulli distribution
-                            # for an average arrival rate of 1 / period
-                            prob = 1.0 / period / options.binomial
-                            for _ in range(options.binomial):
-                                if random.random() < prob:
-                                    try:
-                                        origin, destination, intermediate = generate_origin_destination(
-                                            trip_generator, options)
-                                        idx = generate_one(idx, time, arrivalTime, period,
-                                                           origin, destination, intermediate)
-                                    except Exception as exc:
-                                        if options.verbose:
-                                            print(exc, file=sys.stderr)
-                            time += 1.0
-            else:
-                try:
-                    origins_destinations = [generate_origin_destination(
-                        trip_generator, options) for _ in range(options.flows)]
-                    for i in range(len(times)-1):
-                        for j in range(options.flows):
-                            departureTime = times[i]
-                            arrivalTime = times[i+1]
-                            period = options.period[i]
-                            origin, destination, intermediate = origins_destinations[j]
-                            generate_one(j, departureTime, arrivalTime, period, origin, destination, intermediate, i)
-                except Exception as exc:
-                    if options.verbose:
-                        print(exc, file=sys.stderr)
+            table = TripTableWriter(options.tripTable, options.tripprefix) if options.tripTable else None
+            # sampling and writing alternate, the time spent sampling is recorded by sampled_trips
+            with Profile.phase_of(options, "writing", exclude="sampling"):
+                if options.jobs > 1:
+                    with Profile.phase_of(options, "sampling"):
+                        generate_parallel(fouttrips, table)
+                elif options.aggregate or options.odTable:
+                    generate_aggregated(fouttrips, table)
+                else:
+                    for trip in sampled_trips():
+                        generate_one(fouttrips, trip)
+                        if table:
+                            table.add(trip)
+                if table:
+                    table.close()
 
         fouttrips.write("</routes>\n")
 
@@ -903,39 +2680,56 @@ def main(options):
         if options.verbose:
             print("calling", " ".join(args2))
             sys.stdout.flush()
-        subprocess.call(args2)
+        with Profile.phase_of(options, "routing"):
+            subprocess.call(args2)
         sys.stdout.flush()
         sumolib.xml.insertOptionsHeader(options.routefile, options)
 
-    if options.validate:
+    if options.validate and options.routefile and options.flows == 0 and not options.remove_loops:
+        # the routes contain exactly the routable trips, so a second routing pass is not needed
+        # (duarouter writes flows as single vehicles and removing loops may change the first and last edge,
+        # so these cases still call duarouter again)
+        with Profile.phase_of(options, "validation"):
+            routed = filter_routed_trips(options.tripfile, options.routefile, options.aggregate)
+        if options.verbose:
+            print("kept %s routable %s" % (routed, "flows" if options.aggregate else "trips"))
+    elif options.validate:
         # write to temporary file because the input is read incrementally
-        tmpTrips = options.tripfile + ".tmp"
+        tmpTrips = temporary_name(options.tripfile)
         args2 = args + ['-o', tmpTrips, '--write-trips']
         if options.junctionTaz:
             args2 += ['--write-trips.junctions']
         if options.verbose:
             print("calling", " ".join(args2))
             sys.stdout.flush()
-        subprocess.call(args2)
+        with Profile.phase_of(options, "validation"):
+            subprocess.call(args2)
         sys.stdout.flush()
         os.remove(options.tripfile)  # on windows, rename does not overwrite
         os.rename(tmpTrips, options.tripfile)
         sumolib.xml.insertOptionsHeader(options.tripfile, options)
 
     if trip_generator and options.weights_outprefix:
-        idPrefix = ""
-        if options.tripprefix:
-            idPrefix = options.tripprefix + "."
-        trip_generator.source_generator.write_weights(
-            options.weights_outprefix + SOURCE_SUFFIX,
-            idPrefix + "src", options.begin, options.end)
-        trip_generator.sink_generator.write_weights(
-            options.weights_outprefix + DEST_SUFFIX,
-            idPrefix + "dst", options.begin, options.end)
-        if trip_generator.via_generator:
-            trip_generator.via_generator.write_weights(
-                options.weights_outprefix + VIA_SUFFIX,
-                idPrefix + "via", options.begin, options.end)
+        with Profile.phase_of(options, "weights_output"):
+            idPrefix = ""
+            if options.tripprefix:
+                idPrefix = options.tripprefix + "."
+            for name, suffix, interval_id in (("source_generator", SOURCE_SUFFIX, "src"),
+                                              ("sink_generator", DEST_SUFFIX, "dst"),
+                                              ("via_generator", VIA_SUFFIX, "via")):
+                generator = getattr(trip_generator, name)
+                if generator is None:
+                    continue
+                intervals = None
+                if trip_generator.interval_weights is not None:
+                    intervals = trip_generator.interval_weights.get_intervals(name)
+                if intervals is None:
+                    intervals = [(options.begin, options.end, generator.weights)]
+                generator.write_weights(weights_name(options.weights_outprefix, suffix, options.weightsOutputFormat),
+                                        idPrefix + interval_id, intervals)
+
+    if options.profiler is not None:
+        options.profiler.write(options.tripfile + ".profile.json")
 
     # return wether trips could be generated as requested
     return trip_generator is not None
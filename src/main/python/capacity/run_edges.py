@@ -6,7 +6,8 @@ import sys
 import shutil
 from os.path import join, basename
 
-from utils import init_env, init_workload, create_args, write_scenario, filter_network, vehicle_parameter
+from utils import init_env, init_workload, create_args, write_scenario, filter_network, vehicle_parameter, run_items, \
+    simulate
 
 init_env()
 
@@ -113,44 +114,80 @@ def read_result(folder, edge, scale):
 
 def run(args, edges):
     # saveToFile(edges_ids,"junctions.json")
-    i = 0
+    run_items(args, edges, lambda edge: edge._id, process)
 
-    if args.to_index <= 0:
-        args.to_index = len(edges)
 
-    for x in range(args.from_index, args.to_index):
-        edge = edges[x]
-        i += 1
-        print("Edge id: ", edge._id)
-        print("Number of lanes: ", edge.getLaneNumber(), "speed:", edge.getSpeed())
+def process(args, edge):
+    """ Simulate a single edge within the runner directory and return the output path """
+    print("Edge id: ", edge._id)
+    print("Number of lanes: ", edge.getLaneNumber(), "speed:", edge.getSpeed())
 
-        laneNr = edge.getLaneNumber()  # nr of lanes
+    laneNr = edge.getLaneNumber()  # nr of lanes
 
-        cap = capacity_estimate(edge.getSpeed()) * 0.9 * laneNr
+    cap = capacity_estimate(edge.getSpeed()) * 0.9 * laneNr
 
-        print("Capacity estimate:", cap)
+    print("Capacity estimate:", cap)
 
-        p_network = join(args.runner, "filtered.net.xml")
-        p_routes = join(args.runner, "route.rou.xml")
-        p_detector = join(args.runner, "detector.add.xml")
+    p_network = join(args.runner, "filtered.net.xml")
+    p_routes = join(args.runner, "route.rou.xml")
+    p_detector = join(args.runner, "detector.add.xml")
 
-        filter_network(netconvert, args.network, edge, p_network)
-        writeRouteFile(p_routes, "best", "current", edge._id, cap, args.scenario)
-        p_scenario = join(args.runner, "scenario.sumocfg")
+    filter_network(netconvert, args.network, edge, p_network, cache=args.net_cache)
+    writeRouteFile(p_routes, "best", "current", edge._id, cap, args.scenario)
+    p_scenario = join(args.runner, "scenario.sumocfg")
 
-        write_scenario(p_scenario, basename(p_network), basename(p_routes), basename(p_detector), args.step_length)
+    write_scenario(p_scenario, basename(p_network), basename(p_routes), basename(p_detector), args.step_length)
 
-        go(p_scenario, p_network, edge, p_detector, args)
-        print("####################################################################")
-        print("[" + str(i) + " / " + str(args.to_index - args.from_index) + "]")
+    return go(p_scenario, p_network, edge, p_detector, args)
 
 
-def go(scenario, network, edge, p_detector, args):
-    # while traci.simulation.getMinExpectedNumber() > 0:
+def search_scales(evaluate, patience, coarse=20, fine=5, lower=100, upper=205):
+    """ Search the scale (in percent) with maximum throughput. The coarse grid is traversed upwards until
+     patience scales brought no increase, afterwards the step size is halved around the best scale. """
+
+    results = {}
+
+    def flow(k):
+        if k not in results:
+            results[k] = evaluate(k)
+        return results[k]
+
+    best = lower
+    worse = 0
+    for k in range(lower, upper + 1, coarse):
+        if flow(k) > flow(best):
+            best = k
+            worse = 0
+        elif k != best:
+            worse += 1
+            if worse >= patience:
+                break
+
+    step = coarse // 2
+    while step >= fine:
+        # Keep the step on the grid of the fine resolution
+        step -= step % fine
+        center = best
+        for k in (center - step, center + step):
+            if lower <= k <= upper and flow(k) > flow(best):
+                best = k
+
+        step //= 2
+
+    return sorted(results)
+
+
+def add_arguments(parser):
+    parser.add_argument("--scale-search", type=str, default="sweep", choices=["sweep", "adaptive"],
+                        help="Simulate all demand scales between 1 and 2, or search the scale "
+                             "with maximum throughput adaptively using fewer simulations")
+    parser.add_argument("--scale-patience", type=int, default=2,
+                        help="Number of coarse scales without increase in throughput before the adaptive search "
+                             "stops increasing the scale")
 
-    end = int(600 * (1 / args.step_length))
 
-    res = []
+def go(scenario, network, edge, p_detector, args):
+    # while traci.simulation.getMinExpectedNumber() > 0:
 
     folder = join(args.runner, "detector")
 
@@ -158,12 +195,15 @@ def go(scenario, network, edge, p_detector, args):
     shutil.rmtree(folder, ignore_errors=True)
     os.makedirs(folder, exist_ok=True)
 
-    traci.start([sumoBinary, "-n", network], port=args.port)
+    # The scenarios of all scales of the sweep are loaded into the same SUMO instance,
+    # the adaptive search needs the detector output of each scale before choosing the next one
+    connected = args.sumo_mode != "subprocess" and args.scale_search == "sweep"
+    if connected:
+        traci.start([sumoBinary, "-n", network], port=args.port)
 
-    xr = ["%.2f" % s for s in np.arange(1, 2.1, 0.05)]
+    res = {}
 
-    # Simulate different scales
-    for scale in xr:
+    def simulate_scale(scale):
 
         #print("Running scale", scale)
 
@@ -171,28 +211,47 @@ def go(scenario, network, edge, p_detector, args):
         writeDetectorFile(p_detector, "detector", edge._id, edge.getLaneNumber(), scale)
 
         # Load scenario with desired traffic scaling
-        traci.load(["-c", scenario, "--scale", scale])
+        simulate(sumoBinary, ["-c", scenario, "--scale", scale], 600, args, load=connected)
 
-        try:
-            for step in range(0, end):
-                traci.simulationStep()
-        except Exception as e:
-            print(e)
+    def evaluate(k):
+        scale = "%.2f" % (k / 100)
+        simulate_scale(scale)
+
+        res[scale] = read_result(join(folder, scale), edge._id, scale)
 
-    traci.close()
+        return sum(r["flow"] for r in res[scale])
+
+    if args.scale_search == "adaptive":
+        xr = ["%.2f" % (k / 100) for k in search_scales(evaluate, args.scale_patience)]
+    else:
+        xr = ["%.2f" % s for s in np.arange(1, 2.1, 0.05)]
+
+        # Simulate different scales
+        try:
+            for scale in xr:
+                simulate_scale(scale)
+        finally:
+            if connected:
+                traci.close()
 
     for scale in xr:
-        res.extend(read_result(join(folder, scale), edge._id, scale))
+        if scale not in res:
+            res[scale] = read_result(join(folder, scale), edge._id, scale)
 
-    df = pd.DataFrame(res)
-    df.to_csv(join(args.output, "%s.csv" % edge._id), index=False)
+    print("Simulated scales:", ", ".join(xr))
+
+    df = pd.DataFrame([r for scale in xr for r in res[scale]])
+    out = join(args.output, "%s.csv" % edge._id)
+    df.to_csv(out, index=False)
 
     sys.stdout.flush()
 
+    return out
+
 
 if __name__ == "__main__":
 
-    args = create_args("Determine edge volumes with SUMO")
+    args = create_args("Determine edge volumes with SUMO", add_arguments)
 
     net = sumolib.net.readNet(args.network, withConnections=False, withInternal=False, withFoes=False)
 
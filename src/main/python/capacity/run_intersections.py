@@ -6,11 +6,11 @@ import shutil
 import sys
 from os.path import join, basename
 
-from utils import init_env, create_args, init_workload, write_scenario, filter_network, vehicle_parameter
+from utils import init_env, create_args, init_workload, write_scenario, filter_network, vehicle_parameter, run_items, \
+    simulate
 
 init_env()
 
-import traci  # noqa
 import sumolib.net
 from sumolib import checkBinary  # noqa
 import lxml.etree as ET
@@ -101,98 +101,86 @@ def read_result(folder, **kwargs):
 def run(args, nodes):
     print("Running scenario: " + args.scenario)
 
-    if args.to_index <= 0:
-        args.to_index = len(nodes)
+    run_items(args, nodes, lambda node: node._id, process)
 
-    i = 0
 
-    for x in range(args.from_index, args.to_index):
-        node = nodes[x]
-        i += 1
+def process(args, node):
+    """ Simulate all connections of a single junction within the runner directory and return the output path """
 
-        print("####################################################################")
-        print("Junction id: " + node._id)
+    print("####################################################################")
+    print("Junction id: " + node._id)
 
-        folder = join(args.runner, "detector")
-        p_network = join(args.runner, "filtered.net.xml")
+    folder = join(args.runner, "detector")
+    p_network = join(args.runner, "filtered.net.xml")
 
-        edges = [c.getFrom() for c in node.getConnections()] + [c.getTo() for c in node.getConnections()]
+    edges = [c.getFrom() for c in node.getConnections()] + [c.getTo() for c in node.getConnections()]
 
-        filter_network(netconvert, args.network, edges, p_network, ["--no-internal-links", "false"])
+    filter_network(netconvert, args.network, edges, p_network, ["--no-internal-links", "false"], cache=args.net_cache)
 
-        pairs = set((c.getFrom(), c.getTo()) for c in node.getConnections() if c._direction != c.LINKDIR_TURN)
+    pairs = set((c.getFrom(), c.getTo()) for c in node.getConnections() if c._direction != c.LINKDIR_TURN)
 
-        res = []
+    res = []
 
-        for fromEdge, toEdge in pairs:
+    for fromEdge, toEdge in pairs:
 
-            # Clean old data
-            shutil.rmtree(folder, ignore_errors=True)
-            os.makedirs(folder, exist_ok=True)
+        # Clean old data
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
 
-            p_scenario = join(args.runner, "scenario.sumocfg")
-            p_routes = join(args.runner, "route.rou.xml")
-            p_detector = join(args.runner, "detector.add.xml")
+        p_scenario = join(args.runner, "scenario.sumocfg")
+        p_routes = join(args.runner, "route.rou.xml")
+        p_detector = join(args.runner, "detector.add.xml")
 
-            routes = []
+        routes = []
 
-            # Build routes by trying to use incoming edge, when it is too short
-            if fromEdge._length < 30:
-                routes = [k._id + " " + fromEdge._id + " " + toEdge._id for k, v in fromEdge._incoming.items() if
-                          all(d._direction not in (d.LINKDIR_TURN, d.LINKDIR_LEFT, d.LINKDIR_RIGHT) for d in v)]
+        # Build routes by trying to use incoming edge, when it is too short
+        if fromEdge._length < 30:
+            routes = [k._id + " " + fromEdge._id + " " + toEdge._id for k, v in fromEdge._incoming.items() if
+                      all(d._direction not in (d.LINKDIR_TURN, d.LINKDIR_LEFT, d.LINKDIR_RIGHT) for d in v)]
 
-            if not routes:
-                routes = [fromEdge._id + " " + toEdge._id]
+        if not routes:
+            routes = [fromEdge._id + " " + toEdge._id]
 
-            extra_routes = []
-            # Produce car traffic on the other connections
-            for c in node.getConnections():
-                if c._direction == c.LINKDIR_TURN:
-                    continue
-
-                if c.getFrom() == fromEdge or c.getTo() == toEdge:
-                    continue
-
-                r = c.getFrom()._id + " " + c.getTo()._id
-                if r not in extra_routes:
-                    extra_routes.append(r)
+        extra_routes = []
+        # Produce car traffic on the other connections
+        for c in node.getConnections():
+            if c._direction == c.LINKDIR_TURN:
+                continue
 
-            lanes = [fromEdge._id + "_" + str(i) for i in range(len(fromEdge._lanes))]
+            if c.getFrom() == fromEdge or c.getTo() == toEdge:
+                continue
 
-            writeRouteFile(p_routes, routes, extra_routes, args.scenario)
+            r = c.getFrom()._id + " " + c.getTo()._id
+            if r not in extra_routes:
+                extra_routes.append(r)
 
-            writeDetectorFile(p_detector, "detector", lanes)
+        lanes = [fromEdge._id + "_" + str(i) for i in range(len(fromEdge._lanes))]
 
-            write_scenario(p_scenario, basename(p_network), basename(p_routes), basename(p_detector), args.step_length,
-                           time=1800)
+        writeRouteFile(p_routes, routes, extra_routes, args.scenario)
 
-            go(p_scenario, args)
+        writeDetectorFile(p_detector, "detector", lanes)
 
-            # Read output
-            res.append(read_result(folder,
-                                   junctionId=node._id,
-                                   fromEdgeId=fromEdge._id,
-                                   toEdgeId=toEdge._id))
+        write_scenario(p_scenario, basename(p_network), basename(p_routes), basename(p_detector), args.step_length,
+                       time=1800)
 
-        df = pd.DataFrame(res)
-        df.to_csv(join(args.output, "%s.csv" % node._id), index=False)
+        go(p_scenario, args)
 
-        print("####################################################################")
-        print("[" + str(i) + " / " + str(args.to_index - args.from_index) + "]")
+        # Read output
+        res.append(read_result(folder,
+                               junctionId=node._id,
+                               fromEdgeId=fromEdge._id,
+                               toEdgeId=toEdge._id))
 
+    out = join(args.output, "%s.csv" % node._id)
 
-def go(scenario, args):
-    traci.start([sumoBinary, "-c", scenario])
+    df = pd.DataFrame(res)
+    df.to_csv(out, index=False)
 
-    end = int(1800 * (1 / args.step_length))
+    return out
 
-    try:
-        for step in range(0, end):
-            traci.simulationStep()
-    except Exception as e:
-        print(e)
 
-    traci.close()
+def go(scenario, args):
+    simulate(sumoBinary, ["-c", scenario], 1800, args)
     sys.stdout.flush()
 
 
@@ -4,14 +4,13 @@
 import os
 import sys
 from os.path import join, basename
-from traceback import print_exc
 
-from utils import init_env, init_workload, create_args, write_scenario, filter_network_polygon, vehicle_parameter
+from utils import init_env, init_workload, create_args, write_scenario, filter_network_polygon, vehicle_parameter, \
+    run_items, simulate
 
 init_env()
 
 import sumolib.net
-import traci  # noqa
 
 from sumolib import checkBinary  # noqa
 from randomTrips import main, get_options
@@ -82,48 +81,43 @@ def read_result(out):
 
 
 def run(args, routes, location_offset):
-    i = 0
+    rows = [routes.iloc[x] for x in range(len(routes))]
 
-    if args.to_index <= 0:
-        args.to_index = len(routes)
+    run_items(args, rows, lambda route: route.fromEdge + "_" + route.toEdge,
+              lambda a, route: process(a, route, location_offset))
 
-    for x in range(args.from_index, args.to_index):
-        route = routes.iloc[x]
-        i += 1
 
-        print(route)
+def process(args, route, location_offset):
+    """ Simulate a single route within the runner directory and return the output path """
 
-        p_network = join(args.runner, "filtered.net.xml")
-        p_routes = join(args.runner, "route.rou.xml")
-        p_detector = join(args.runner, "detector.add.xml")
-        p_trips = join(args.runner, "trips.trips.xml")
+    print(route)
 
-        # 1hour simulation plus travel time
-        end = int(route.travel_time + 3600)
+    p_network = join(args.runner, "filtered.net.xml")
+    p_routes = join(args.runner, "route.rou.xml")
+    p_detector = join(args.runner, "detector.add.xml")
+    p_trips = join(args.runner, "trips.trips.xml")
 
-        filter_network_polygon(netconvert, args.network, location_offset, route.geometry, p_network)
+    # 1hour simulation plus travel time
+    end = int(route.travel_time + 3600)
 
-        # Nearly uncongested vehicle flow
-        writeRouteFile(p_routes, route.fromEdge, route.toEdge, int(route.min_capacity * 0.3), end, args.scenario)
-        writeDetectorFile(p_detector, route.travel_time)
+    filter_network_polygon(netconvert, args.network, location_offset, route.geometry, p_network, cache=args.net_cache)
 
-        # Produce some very light traffic on the other roads
-        main(get_options(["-n", p_network, "-o", p_trips, "-r", join(args.runner, "random_routes.rou.xml"),
-                          "--validate", "-e", end, '-t type="vDist"',
-                          "--insertion-density", "10", "--fringe-factor", "max"]))
+    # Nearly uncongested vehicle flow
+    writeRouteFile(p_routes, route.fromEdge, route.toEdge, int(route.min_capacity * 0.3), end, args.scenario)
+    writeDetectorFile(p_detector, route.travel_time)
 
-        p_scenario = join(args.runner, "scenario.sumocfg")
+    # Produce some very light traffic on the other roads
+    main(get_options(["-n", p_network, "-o", p_trips, "-r", join(args.runner, "random_routes.rou.xml"),
+                      "--validate", "-e", end, '-t type="vDist"',
+                      "--insertion-density", "10", "--fringe-factor", "max"]))
 
-        write_scenario(p_scenario, basename(p_network), basename(p_routes) + "," + "trips.trips.xml",
-                       basename(p_detector), args.step_length, end)
+    p_scenario = join(args.runner, "scenario.sumocfg")
 
-        try:
-            go(p_scenario, p_network, end, route.fromEdge + "_" + route.toEdge, args)
-        except Exception as e:
-            print_exc()
+    write_scenario(p_scenario, basename(p_network), basename(p_routes) + "," + "trips.trips.xml",
+                   basename(p_detector), args.step_length, end)
 
-        print("####################################################################")
-        print("[" + str(i) + " / " + str(args.to_index - args.from_index) + "]")
+    # Failures are recorded in the manifest
+    return go(p_scenario, p_network, end, route.fromEdge + "_" + route.toEdge, args)
 
 
 def go(scenario, network, end, f, args):
@@ -133,25 +127,15 @@ def go(scenario, network, end, f, args):
     if os.path.exists(out):
         os.remove(out)
 
-    traci.start([sumoBinary, "-n", network], port=args.port)
-
-    steps = int(end * (1 / args.step_length))
-
-    # Load scenario with desired traffic scaling
-    traci.load(["-c", scenario])
-    try:
-        for step in range(0, steps):
-            traci.simulationStep()
-    except Exception as e:
-        print(e)
-
-    traci.close()
+    simulate(sumoBinary, ["-c", scenario], end, args)
 
     res = read_result(out)
     res.to_csv(join(args.output, f + ".csv"), index=False)
 
     sys.stdout.flush()
 
+    return join(args.output, f + ".csv")
+
 
 if __name__ == "__main__":
     args = create_args("Determine avg. uncongested trip speed per link with SUMO")
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The capacity scripts are plain modules within the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_randomTrips import grid_net  # noqa
+
+
+@pytest.fixture
+def grid(tmp_path):
+    """ Synthetic 10 x 10 grid with edges of 200m in both directions """
+    f = str(tmp_path / "grid.net.xml")
+    grid_net(f, 10)
+    return f
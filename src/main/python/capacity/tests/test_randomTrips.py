@@ -0,0 +1,625 @@
+import gzip
+import os
+import random
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+import sumolib
+
+import randomTrips
+from benchmark_randomTrips import grid_net, write_net
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Weight options with the name of their expected weight files in the data folder,
+# these files were written by randomTrips before the vectorized weights
+WEIGHT_CASES = {
+    "default": [],
+    "length_lanes": ["-l", "-L", "--speed-exponent", "1"],
+    "fringe_speed": ["--fringe-factor", "5", "--speed-exponent", "1", "--fringe-speed-exponent", "2"],
+    "fringe_max": ["--fringe-factor", "max"],
+    "angle_threshold": ["--angle", "45", "--angle-factor", "3", "--fringe-factor", "2", "--fringe-threshold", "10"],
+    "no_fringe": ["--fringe-speed-exponent", "2"],
+}
+
+
+def departures(f_name):
+    with open(f_name) as f:
+        return [float(d) for d in re.findall(r'<trip [^>]*depart="([\d.]+)"', f.read())]
+
+
+def test_failed_batch_slots_keep_departure_profile(grid, tmp_path):
+    """ Trips which could not be found with --batch-size must not cut off the end of the interval """
+
+    for batch in ("0", "1000"):
+        out = str(tmp_path / ("trips%s.xml" % batch))
+        randomTrips.main(randomTrips.get_options([
+            "-n", grid, "-o", out, "-e", "1000", "-p", "1", "--seed", "42",
+            "--min-distance", "2000", "--maxtries", "1", "--batch-size", batch]))
+
+        depart = departures(out)
+        assert 0 < len(depart) < 1000
+        assert max(depart) > 900
+
+
+def test_alias_table_frequencies():
+    weights = np.array([1., 0., 3., 6.])
+    table = randomTrips.AliasTable(weights)
+
+    counts = np.bincount(table.draw_many(200000, np.random.default_rng(1)), minlength=len(weights))
+    assert np.allclose(counts / counts.sum(), weights / weights.sum(), atol=0.01)
+
+    random.seed(1)
+    counts = np.bincount([table.draw() for _ in range(200000)], minlength=len(weights))
+    assert np.allclose(counts / counts.sum(), weights / weights.sum(), atol=0.01)
+
+
+def test_spatial_sinks_within_distance_ring():
+    rng = np.random.default_rng(2)
+    n = 2000
+    xy = rng.random((n, 2)) * 1000
+    weights = rng.random(n)
+    weights[::10] = 0
+    sampler = randomTrips.SpatialSinkSampler(weights, xy, np.arange(n), xy, 200, 400)
+
+    sources = rng.integers(0, n, 10000)
+    sinks = sampler.draw_many(sources, rng.random(len(sources)))
+    assert (sinks >= 0).all()
+    distance = np.hypot(*(xy[sinks] - xy[sources]).T)
+    assert (distance >= 200).all() and (distance < 400).all()
+    assert (weights[sinks] > 0).all()
+
+    for source in sources[:100]:
+        sink = sampler.draw(source, rng.random())
+        assert 200 <= np.hypot(*(xy[sink] - xy[source])) < 400
+
+    # no edge is further away than the diagonal of the area
+    sampler = randomTrips.SpatialSinkSampler(weights, xy, np.arange(n), xy, 1500, None)
+    assert (sampler.draw_many(sources, rng.random(len(sources))) == -1).all()
+
+
+def test_reachability_rejects_pairs_across_components(tmp_path):
+    f = str(tmp_path / "components.net.xml")
+    # one-way ring a, b, c with a dead end to d and a second ring e, f, g
+    nodes = {"a": (0., 0.), "b": (200., 0.), "c": (100., 200.), "d": (100., 400.),
+             "e": (1000., 0.), "f": (1200., 0.), "g": (1100., 200.)}
+    links = [("a", "b"), ("b", "c"), ("c", "a"), ("c", "d"), ("e", "f"), ("f", "g"), ("g", "e")]
+    # one-way chain with a component per edge, so that the sets span several bytes
+    nodes.update(("h%d" % i, (2000. + 100 * i, 0.)) for i in range(21))
+    links += [("h%d" % i, "h%d" % (i + 1)) for i in range(20)]
+    write_net(f, nodes, links)
+
+    net = sumolib.net.readNet(f)
+    reach = randomTrips.Reachability(net, "passenger")
+    index = {edge.getID(): i for i, edge in enumerate(net._edges)}
+
+    def connected(*edges):
+        return reach.connected([index[e] for e in edges])
+
+    assert connected("a_b", "c_a")
+    assert connected("b_c", "c_d")
+    assert not connected("c_d", "a_b")
+    assert not connected("a_b", "e_f")
+    assert not connected("a_b", "c_d", "a_b")
+    assert connected("e_f", "g_e", "f_g")
+    assert connected("h0_h1", "h9_h10", "h19_h20")
+    assert not connected("h19_h20", "h0_h1")
+
+    sources = np.array([index[e] for e in ("a_b", "c_d", "a_b", "f_g")])
+    sinks = np.array([index[e] for e in ("c_d", "b_c", "g_e", "e_f")])
+    assert reach.connected_many([sources, sinks]).tolist() == [True, False, False, True]
+
+
+def test_fenwick_tree_frequencies_after_update_weights(grid):
+    net = sumolib.net.readNet(grid)
+    generator = randomTrips.RandomEdgeGenerator(net, lambda edge: 1.)
+    rng = np.random.default_rng(3)
+
+    weights = np.zeros(len(net._edges))
+    weights[[3, 10, 50]] = [1., 2., 5.]
+    for update in ({}, {10: 0., 100: 4.}):
+        for index, weight in update.items():
+            weights[index] = weight
+        generator.update_weights(weights.copy())
+        assert isinstance(generator.table, randomTrips.FenwickTree)
+
+        counts = np.bincount(generator.get_many(200000, rng), minlength=len(weights))
+        assert np.allclose(counts / counts.sum(), weights / weights.sum(), atol=0.01)
+
+        random.seed(3)
+        counts = np.bincount([generator.table.draw() for _ in range(100000)], minlength=len(weights))
+        assert np.allclose(counts / counts.sum(), weights / weights.sum(), atol=0.01)
+
+
+def test_interval_weights_fall_back_to_base_weights(grid, tmp_path):
+    prefix = str(tmp_path / "w")
+    with open(prefix + ".src.xml", "w") as f:
+        f.write('<edgedata>\n')
+        f.write('    <interval id="a" begin="0" end="100"><edge id="0/0_1/0" value="1"/></interval>\n')
+        f.write('    <interval id="b" begin="100" end="200"><edge id="1/0_2/0" value="1"/></interval>\n')
+        f.write('</edgedata>\n')
+
+    out = str(tmp_path / "trips.xml")
+    randomTrips.main(randomTrips.get_options([
+        "-n", grid, "-o", out, "-b", "0", "-e", "400", "-p", "1", "1", "1", "1", "--seed", "42",
+        "--weights-prefix", prefix, "--weights-output-prefix", str(tmp_path / "out")]))
+
+    with open(out) as f:
+        trips = re.findall(r'<trip [^>]*depart="([\d.]+)" from="([^"]+)"', f.read())
+    sources = [{edge for depart, edge in trips if begin <= float(depart) < begin + 100} for begin in (0, 100, 200, 300)]
+    assert sources[0] == {"0/0_1/0"}
+    assert sources[1] == {"1/0_2/0"}
+    assert len(sources[2]) > 10 and len(sources[3]) > 10
+
+    intervals = list(sumolib.xml.parse(str(tmp_path / "out.src.xml"), "interval"))
+    assert [(i.begin, i.end) for i in intervals] == [("0", "100"), ("100", "200"), ("200", "300"), ("300", "400")]
+    assert [e.id for e in intervals[0].edge if float(e.value) > 0] == ["0/0_1/0"]
+    assert len([e for e in intervals[2].edge if float(e.value) > 0]) > 10
+
+
+def test_spatial_sink_cache_is_bounded():
+    rng = np.random.default_rng(4)
+    n = 2000
+    xy = rng.random((n, 2)) * 1000
+    weights = rng.random(n)
+    sources = rng.integers(0, n, 5000)
+    u = rng.random(len(sources))
+
+    unbounded = randomTrips.SpatialSinkSampler(weights, xy, np.arange(n), xy, 100, None)
+    bounded = randomTrips.SpatialSinkSampler(weights, xy, np.arange(n), xy, 100, None)
+    bounded.CACHE_BYTES = 64 << 10
+
+    for chunk in np.array_split(np.arange(len(sources)), 10):
+        assert (bounded.draw_many(sources[chunk], u[chunk]) == unbounded.draw_many(sources[chunk], u[chunk])).all()
+        assert bounded.cache_bytes <= bounded.CACHE_BYTES
+        assert bounded.cache_bytes == sum(a.nbytes for ranges in bounded.cache.values() for a in ranges)
+    assert len(bounded.cache) < len(unbounded.cache)
+
+
+def fringe_net(f_name):
+    """ 5 x 5 grid with a slower middle row and one-way spurs entering and leaving the grid, which are fringe edges """
+    nodes = {"%d/%d" % (i, j): (i * 200., j * 200.) for i in range(5) for j in range(5)}
+    nodes.update({"in0": (-200., 0.), "in1": (400., -200.), "out0": (1000., 800.), "out1": (400., 1000.)})
+
+    links = []
+    for i in range(5):
+        for j in range(5):
+            if i + 1 < 5:
+                links += [("%d/%d" % (i, j), "%d/%d" % (i + 1, j)), ("%d/%d" % (i + 1, j), "%d/%d" % (i, j))]
+            if j + 1 < 5:
+                links += [("%d/%d" % (i, j), "%d/%d" % (i, j + 1)), ("%d/%d" % (i, j + 1), "%d/%d" % (i, j))]
+    spurs = [("in0", "0/0"), ("in1", "2/0"), ("4/4", "out0"), ("2/4", "out1")]
+
+    speeds = {link: 8.33 for link in links if nodes[link[0]][1] == nodes[link[1]][1] == 400.}
+    speeds.update({spurs[0]: 27.78, spurs[1]: 8.33, spurs[2]: 27.78, spurs[3]: 5.0})
+
+    write_net(f_name, nodes, links + spurs, speeds=speeds)
+
+
+@pytest.mark.parametrize("case", sorted(WEIGHT_CASES))
+def test_weights_output_equals_reference(tmp_path, case):
+    net = str(tmp_path / "net.net.xml")
+    if case == "no_fringe":
+        grid_net(net, 5)
+    else:
+        fringe_net(net)
+
+    prefix = str(tmp_path / case)
+    randomTrips.main(randomTrips.get_options(["-n", net, "-o", str(tmp_path / "trips.xml"), "-e", "10",
+                                              "--seed", "42", "--weights-output-prefix", prefix]
+                                             + WEIGHT_CASES[case]))
+
+    for suffix in (randomTrips.SOURCE_SUFFIX, randomTrips.DEST_SUFFIX, randomTrips.VIA_SUFFIX):
+        with open(prefix + suffix, "rb") as f, open(os.path.join(DATA, "weights", case + suffix), "rb") as ref:
+            assert f.read() == ref.read(), case + suffix
+
+
+def test_filter_routed_trips_keeps_routed_elements(tmp_path):
+    trips = str(tmp_path / "trips.xml")
+    with open(trips, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<routes>\n'
+                '    <trip id="0" depart="0.00" from="a" to="b" departLane="best"/>\n'
+                '    <trip id="1" depart="1.00" from="a" to="c"/>\n'
+                '    <person id="2" depart="2.00">\n'
+                '        <walk from="c" to="d"/>\n'
+                '    </person>\n'
+                '    <person id="3" depart="3.00" type="ped">\n'
+                '        <walk from="a" to="e"/>\n'
+                '    </person>\n'
+                '    <trip id="4" depart="4.00" from="d" to="b" arrivalPos="random"/>\n'
+                '</routes>\n')
+
+    routes = str(tmp_path / "routes.xml")
+    with open(routes, "w") as f:
+        f.write('<routes>\n'
+                '    <vehicle id="0" depart="0.00">\n        <route edges="a b"/>\n    </vehicle>\n'
+                '    <person id="3" depart="3.00" type="ped">\n        <walk edges="a e"/>\n    </person>\n'
+                '    <vehicle id="4" depart="4.00">\n        <route edges="d b"/>\n    </vehicle>\n'
+                '</routes>\n')
+
+    assert randomTrips.filter_routed_trips(trips, routes) == 3
+
+    with open(trips) as f:
+        assert f.read() == ('<?xml version="1.0" encoding="UTF-8"?>\n<routes>\n'
+                            '    <trip id="0" depart="0.00" from="a" to="b" departLane="best"/>\n'
+                            '    <person id="3" depart="3.00" type="ped">\n'
+                            '        <walk from="a" to="e"/>\n'
+                            '    </person>\n'
+                            '    <trip id="4" depart="4.00" from="d" to="b" arrivalPos="random"/>\n'
+                            '</routes>\n')
+
+
+def test_filter_routed_flows(tmp_path):
+    trips = str(tmp_path / "trips.xml")
+    with open(trips, "w") as f:
+        f.write('<routes>\n'
+                '    <flow id="a_b" begin="0.00" end="10.00" number="2" from="a" to="b"/>\n'
+                '    <flow id="a_c" begin="0.00" end="10.00" number="1" from="a" to="c"/>\n'
+                '</routes>\n')
+
+    routes = str(tmp_path / "routes.xml")
+    with open(routes, "w") as f:
+        f.write('<routes>\n    <vehicle id="a_b.1" depart="5.00">\n        <route edges="a b"/>\n    </vehicle>\n'
+                '</routes>\n')
+
+    randomTrips.filter_routed_trips(trips, routes, flows=True)
+
+    with open(trips) as f:
+        assert f.read() == '<routes>\n    <flow id="a_b" begin="0.00" end="10.00" number="2" from="a" to="b"/>\n</routes>\n'
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_jobs_are_reproducible(grid, tmp_path, jobs):
+    """ The same seed gives the same trips for a given number of jobs """
+
+    contents = []
+    for run in range(2):
+        out = str(tmp_path / ("trips%d.xml" % run))
+        randomTrips.main(randomTrips.get_options([
+            "-n", grid, "-o", out, "-e", "3600", "-p", "2", "--seed", "7", "--jobs", str(jobs),
+            "--min-distance", "500", "--fringe-factor", "3", "--random-departpos"]))
+
+        with open(out) as f:
+            # The header contains the time of generation and the options
+            contents.append(re.sub(r"<!--.*?-->", "", f.read(), count=1, flags=re.S))
+
+    assert contents[0] == contents[1]
+    assert len(departures(out)) == 1800
+    assert max(departures(out)) > 3500
+
+
+def net_summary(net):
+    return ([(e.getID(), e.getFromNode().getID(), e.getToNode().getID(), e.getLength(), e.getSpeed(),
+              e.getLaneNumber(), sorted(o.getID() for o in e.getOutgoing()), e.is_fringe()) for e in net.getEdges()],
+            [(n.getID(), n.getCoord(), n.getType()) for n in net.getNodes()],
+            net.getBBoxXY(), net.getLocationOffset())
+
+
+def test_net_cache_equals_parsed_net(tmp_path, monkeypatch):
+    net = str(tmp_path / "net.net.xml")
+    fringe_net(net)
+    parsed = net_summary(randomTrips.load_net(net))
+
+    assert net_summary(randomTrips.load_net(net, cache=True)) == parsed
+    assert os.path.isfile(net + randomTrips.NET_CACHE_SUFFIX)
+
+    def read_net(*args, **kwargs):
+        raise AssertionError("the cached net is parsed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(sumolib.net, "readNet", read_net)
+        cached = randomTrips.load_net(net, cache=True)
+    assert net_summary(cached) == parsed
+
+    # a changed net file invalidates the cache
+    grid_net(net, 4)
+    assert net_summary(randomTrips.load_net(net, cache=True)) == net_summary(randomTrips.load_net(net))
+    assert len(randomTrips.load_net(net, cache=True).getEdges()) == 48
+
+
+def test_net_cache_gives_same_trips(grid, tmp_path):
+    contents = []
+    for run, cache in enumerate(([], ["--net-cache"], ["--net-cache"])):
+        out = str(tmp_path / ("trips%d.xml" % run))
+        randomTrips.main(randomTrips.get_options(["-n", grid, "-o", out, "-e", "500", "--seed", "3",
+                                                  "--fringe-factor", "2", "--min-distance", "300"] + cache))
+        with open(out) as f:
+            contents.append(re.sub(r"<!--.*?-->", "", f.read(), count=1, flags=re.S))
+
+    assert contents[0] == contents[1] == contents[2]
+
+
+def test_iter_trips_match_written_trips(grid, tmp_path):
+    args = ["-e", "300", "--seed", "5", "--fringe-factor", "2", "--intermediate", "1"]
+    out = str(tmp_path / "trips.xml")
+    randomTrips.main(randomTrips.get_options(["-n", grid, "-o", out] + args))
+    with open(out) as f:
+        written = re.findall(r'<trip id="(\d+)" depart="([\d.]+)" from="([^"]+)" to="([^"]+)" via="([^"]+)"', f.read())
+
+    net = sumolib.net.readNet(grid)
+    options = randomTrips.get_options(args, net=net)
+    trips = list(randomTrips.iter_trips(options))
+    assert [("%s" % t.id, "%.2f" % t.depart, t.origin.getID(), t.destination.getID(),
+             " ".join(e.getID() for e in t.intermediate)) for t in trips] == written
+
+    # the options can be reused
+    assert [(t.id, t.depart, t.origin, t.destination) for t in randomTrips.iter_trips(options)] == \
+        [(t.id, t.depart, t.origin, t.destination) for t in trips]
+
+    batches = list(randomTrips.iter_trip_batches(options, size=100))
+    assert [len(b) for b in batches] == [100, 100, 100]
+    batch = np.concatenate(batches)
+    assert [net._edges[i].getID() for i in batch["origin"]] == [t.origin.getID() for t in trips]
+    assert [net._edges[i[0]].getID() for i in batch["via"]] == [t.intermediate[0].getID() for t in trips]
+
+
+def trip_body(f_name):
+    """ Content of a trip file without the header with time of generation and options """
+    with (gzip.open(f_name, "rt") if f_name.endswith(".gz") else open(f_name)) as f:
+        return re.sub(r"<!--.*?-->", "", f.read(), count=1, flags=re.S)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.parametrize("table", ["trips.csv", "trips.parquet"])
+def test_gzip_output_and_trip_table(grid, tmp_path, jobs, table):
+    args = ["-n", grid, "-e", "400", "-p", "2", "--seed", "11", "--prefix", "t", "--intermediate", "1",
+            "--jobs", str(jobs)]
+    plain = str(tmp_path / "trips.xml")
+    randomTrips.main(randomTrips.get_options(args + ["-o", plain]))
+    compressed = str(tmp_path / "trips.xml.gz")
+    randomTrips.main(randomTrips.get_options(args + ["-o", compressed, "--trip-table", str(tmp_path / table)]))
+
+    with open(compressed, "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+    assert trip_body(compressed) == trip_body(plain)
+
+    trips = re.findall(r'<trip id="([^"]+)" depart="([\d.]+)" from="([^"]+)" to="([^"]+)" via="([^"]+)"',
+                       trip_body(plain))
+    assert len(trips) == 200
+
+    df = pd.read_parquet(str(tmp_path / table)) if table.endswith(".parquet") else \
+        pd.read_csv(str(tmp_path / table), dtype={"id": str})
+    assert list(df.columns) == ["id", "depart", "from", "to", "via", "interval"]
+    assert list(zip(df["id"], df["depart"].map("%.2f".__mod__), df["from"], df["to"], df["via"])) == trips
+
+
+def test_vectorized_schedule(grid):
+    rng = np.random.default_rng(1)
+
+    options = randomTrips.get_options(["-n", grid, "-p", "2.5"])
+    assert randomTrips.get_schedule_rng(options) is None
+    assert randomTrips.get_departures(options, 100, 110, 2.5) == [100, 102.5, 105, 107.5]
+
+    # one uniform departure per period, at multiples of the subsecond part of the period
+    options = randomTrips.get_options(["-n", grid, "-p", "2.5", "--random-depart"])
+    depart = np.array(randomTrips.get_departures(options, 100, 1100, 2.5, rng))
+    assert len(depart) == 400
+    assert (np.diff(depart) >= 0).all()
+    assert depart.min() >= 100 and depart.max() <= 1100
+    assert set(np.fmod(depart, 1)) == {0, 0.5}
+    assert abs(np.mean(depart) - 600) < 30
+
+    # at most N departures per second with an expected rate of 1 / period
+    options = randomTrips.get_options(["-n", grid, "-p", "0.5", "--binomial", "4"])
+    depart = np.array(randomTrips.get_departures(options, 0, 10000, 0.5, rng))
+    assert (np.fmod(depart, 1) == 0).all()
+    assert np.bincount(depart.astype(int)).max() <= 4
+    assert abs(len(depart) - 20000) < 300
+
+    # the schedule only depends on the seed
+    schedules = []
+    for _ in range(2):
+        options = randomTrips.get_options(["-n", grid, "-p", "3", "--random-depart", "--seed", "8"])
+        randomTrips.init_generation(options)
+        schedules.append(randomTrips.get_schedule(options, randomTrips.get_schedule_rng(options)))
+    assert schedules[0] == schedules[1]
+    assert len(schedules[0]) == 1200
+
+
+@pytest.mark.parametrize("fmt", ["npz", "parquet"])
+def test_binary_weights_output(tmp_path, fmt):
+    net = str(tmp_path / "net.net.xml")
+    fringe_net(net)
+    args = ["-n", net, "-o", str(tmp_path / "trips.xml"), "-e", "10"]
+    weights = ["-l", "--fringe-factor", "5", "--speed-exponent", "1"]
+
+    randomTrips.main(randomTrips.get_options(args + weights + ["--weights-output-prefix", str(tmp_path / "xml")]))
+    randomTrips.main(randomTrips.get_options(args + weights + ["--weights-output-prefix", str(tmp_path / "bin"),
+                                                               "--weights-output-format", fmt]))
+
+    for suffix in (randomTrips.SOURCE_SUFFIX, randomTrips.DEST_SUFFIX, randomTrips.VIA_SUFFIX):
+        xml_ids, xml_values = randomTrips.read_weights(str(tmp_path / "xml") + suffix)
+        ids, values = randomTrips.read_weights(randomTrips.weights_name(str(tmp_path / "bin"), suffix, fmt))
+        assert sorted(ids) == sorted(xml_ids)
+        values = dict(zip(ids, values))
+        assert np.allclose([values[e] for e in xml_ids], xml_values, atol=0.005)
+
+    # the binary weights are read as input and give the same weights as the ones computed from the options
+    randomTrips.main(randomTrips.get_options(args + ["--weights-prefix", str(tmp_path / "bin"),
+                                                     "--weights-output-prefix", str(tmp_path / "reloaded")]))
+    for suffix in (randomTrips.SOURCE_SUFFIX, randomTrips.DEST_SUFFIX, randomTrips.VIA_SUFFIX):
+        with open(str(tmp_path / "xml") + suffix) as f, open(str(tmp_path / "reloaded") + suffix) as reloaded:
+            assert f.read() == reloaded.read()
+
+
+def test_weights_cache(grid, tmp_path, monkeypatch):
+    table = randomTrips.get_edge_table(randomTrips.get_options(["-n", grid]))
+    fname = str(tmp_path / "w.src.xml")
+
+    def write(values):
+        with open(fname, "w") as f:
+            f.write('<edgedata>\n    <interval id="src" begin="0" end="3600">\n')
+            f.write("".join('        <edge id="%s" value="%s"/>\n' % item for item in values.items()))
+            f.write('    </interval>\n</edgedata>\n')
+
+    write({"0/0_1/0": 3, "5/5_5/6": 1.5, "unknown": 7})
+    expected = np.zeros(len(table))
+    expected[table.index["0/0_1/0"]] = 3
+    expected[table.index["5/5_5/6"]] = 1.5
+
+    assert (randomTrips.load_weights(fname, table) == expected).all()
+    assert (randomTrips.load_weights(fname, table, cache=True) == expected).all()
+    assert os.path.isfile(fname + randomTrips.WEIGHTS_CACHE_SUFFIX)
+
+    def read_weights(f_name):
+        raise AssertionError("the cached weights are read again")
+
+    with monkeypatch.context() as m:
+        m.setattr(randomTrips, "read_weights", read_weights)
+        assert (randomTrips.load_weights(fname, table, cache=True) == expected).all()
+
+    # changed weights invalidate the cache
+    write({"0/0_1/0": 2})
+    expected[:] = 0
+    expected[table.index["0/0_1/0"]] = 2
+    assert (randomTrips.load_weights(fname, table, cache=True) == expected).all()
+
+    # as does another edge order
+    other = str(tmp_path / "other.net.xml")
+    fringe_net(other)
+    other_table = randomTrips.get_edge_table(randomTrips.get_options(["-n", other]))
+    weights = randomTrips.load_weights(fname, other_table, cache=True)
+    assert len(weights) == len(other_table) and weights[other_table.index["0/0_1/0"]] == 2 and weights.sum() == 2
+
+
+def test_fringe_flags(tmp_path):
+    net = str(tmp_path / "net.net.xml")
+    fringe_net(net)
+    with open(net) as f:
+        content = f.read()
+    with open(net, "w") as f:
+        f.write(re.sub(r'(<junction id="(?:0/0|4/4)")', r'\1 fringe="outer"', content))
+
+    net = sumolib.net.readNet(net)
+    flags = randomTrips.fringe_flags(net)
+    for edge, flag in zip(net._edges, flags.tolist()):
+        assert bool(flag & randomTrips.FRINGE_INCOMING) == edge.is_fringe(edge._incoming)
+        assert bool(flag & randomTrips.FRINGE_OUTGOING) == edge.is_fringe(edge._outgoing)
+        assert bool(flag & randomTrips.FRINGE_JUNCTION_INCOMING) == edge.is_fringe(edge._incoming, True)
+        assert bool(flag & randomTrips.FRINGE_JUNCTION_OUTGOING) == edge.is_fringe(edge._outgoing, True)
+        assert bool(flag & randomTrips.FRINGE_ANY) == edge.is_fringe()
+
+    assert sorted(e.getID() for e, flag in zip(net._edges, flags) if flag & randomTrips.FRINGE_INCOMING) == \
+        ["in0_0/0", "in1_2/0"]
+    assert sorted(e.getID() for e, flag in zip(net._edges, flags) if flag & randomTrips.FRINGE_JUNCTION_INCOMING) == \
+        ["0/0_0/1", "0/0_1/0", "4/4_3/4", "4/4_4/3", "4/4_out0"]
+    assert randomTrips.fringe_flags(net) is flags
+
+    # all trips start at the fringe given by the junctions
+    options = randomTrips.get_options(["-e", "200", "--fringe-factor", "max", "--fringe-junctions"], net=net)
+    assert {t.origin.getID() for t in randomTrips.iter_trips(options)} <= \
+        {"0/0_0/1", "0/0_1/0", "4/4_3/4", "4/4_4/3", "4/4_out0"}
+
+
+def test_aggregate_counts_sampled_trips(tmp_path):
+    net = str(tmp_path / "net.net.xml")
+    grid_net(net, 3)
+    args = ["-n", net, "-e", "1000", "-p", "1,2", "--seed", "6"]
+
+    trips = str(tmp_path / "trips.xml")
+    od = str(tmp_path / "od.csv")
+    randomTrips.main(randomTrips.get_options(args + ["-o", trips, "--od-table", od]))
+    with open(trips) as f:
+        sampled = Counter((int(float(d) >= 500), o, d2) for d, o, d2 in
+                          re.findall(r'<trip id="\d+" depart="([\d.]+)" from="([^"]+)" to="([^"]+)"', f.read()))
+    assert sum(sampled.values()) == 750
+
+    df = pd.read_csv(od, keep_default_na=False)
+    assert list(df.columns) == ["interval", "begin", "end", "from", "to", "via", "count"]
+    assert dict(zip(zip(df["interval"], df["from"], df["to"]), df["count"])) == sampled
+    assert set(zip(df["interval"], df["begin"], df["end"])) == {(0, 0, 500), (1, 500, 1000)}
+
+    flows = str(tmp_path / "flows.xml")
+    randomTrips.main(randomTrips.get_options(args + ["-o", flows, "--aggregate"]))
+    with open(flows) as f:
+        aggregated = {(int(b == "500"), o, d): int(n) for b, n, o, d in re.findall(
+            r'<flow id="\d+" begin="(\d+)" end="\d+" number="(\d+)" from="([^"]+)" to="([^"]+)"', f.read())}
+    assert aggregated == sampled
+
+
+@pytest.mark.parametrize("batch", ["0", "1000"])
+def test_zone_trips_follow_od_matrix(grid, tmp_path, batch):
+    """ Trips between the quadrants of the grid, the edges crossing the middle lie outside of all zones """
+    bounds = {"sw": (-50, -50, 850, 850), "se": (950, -50, 1850, 850),
+              "nw": (-50, 950, 850, 1850), "ne": (950, 950, 1850, 1850)}
+    zones = str(tmp_path / "zones.poly.xml")
+    with open(zones, "w") as f:
+        f.write("<additional>\n")
+        for zone, (x1, y1, x2, y2) in bounds.items():
+            f.write('    <poly id="%s" shape="%s,%s %s,%s %s,%s %s,%s"/>\n' % (zone, x1, y1, x2, y1, x2, y2, x1, y2))
+        f.write("</additional>\n")
+    matrix = {("sw", "ne"): 600, ("ne", "sw"): 300, ("sw", "sw"): 100, ("nw", "se"): 0}
+    od = str(tmp_path / "od.csv")
+    with open(od, "w") as f:
+        f.write("from,to,count\n" + "".join("%s,%s,%s\n" % (o, d, n) for (o, d), n in matrix.items()))
+
+    out = str(tmp_path / "trips.xml")
+    randomTrips.main(randomTrips.get_options(["-n", grid, "-o", out, "-e", "5000", "--seed", "9",
+                                              "--od-matrix", od, "--zones", zones, "--batch-size", batch]))
+
+    net = sumolib.net.readNet(grid)
+
+    def zone(edge):
+        (x1, y1), (x2, y2) = net.getEdge(edge).getShape()[0], net.getEdge(edge).getShape()[-1]
+        x, y = (x1 + x2) / 2, (y1 + y2) / 2
+        return next(z for z, (zx1, zy1, zx2, zy2) in bounds.items() if zx1 <= x <= zx2 and zy1 <= y <= zy2)
+
+    with open(out) as f:
+        trips = Counter((zone(o), zone(d)) for o, d in re.findall(r'<trip [^>]*from="([^"]+)" to="([^"]+)"', f.read()))
+    assert sum(trips.values()) == 5000
+    assert set(trips) == {pair for pair, n in matrix.items() if n > 0}
+    for pair, n in matrix.items():
+        assert abs(trips[pair] / 5000 - n / 1000) < 0.03
+
+
+def test_stops_cache_and_index(grid, tmp_path, monkeypatch):
+    stops = str(tmp_path / "stops.add.xml")
+
+    def write(extra=""):
+        with open(stops, "w") as f:
+            f.write('<additional>\n'
+                    '    <busStop id="b0" lane="0/0_1/0_0" startPos="10" endPos="30"/>\n'
+                    '    <busStop id="b1" lane="0/0_1/0_0" startPos="50" endPos="70"/>\n'
+                    '    <busStop id="b2" lane="5/5_5/6_0" startPos="10" endPos="30"/>\n'
+                    '    <parkingArea id="p0" lane="3/3_4/3_0" startPos="10" endPos="30"/>\n'
+                    + extra + '</additional>\n')
+
+    write()
+    parsed = randomTrips.read_stops(stops, ["busStop", "parkingArea"])
+    assert [column.tolist() for column in parsed] == [["busStop"] * 3 + ["parkingArea"], ["b0", "b1", "b2", "p0"],
+                                                      ["0/0_1/0", "0/0_1/0", "5/5_5/6", "3/3_4/3"]]
+
+    def parse(*args, **kwargs):
+        raise AssertionError("the cached stops are parsed again")
+
+    randomTrips.read_stops(stops, ["busStop", "parkingArea"], cache=True)
+    with monkeypatch.context() as m:
+        m.setattr(sumolib.xml, "parse", parse)
+        cached = randomTrips.read_stops(stops, ["parkingArea", "busStop"], cache=True)
+    assert [column.tolist() for column in cached] == [column.tolist() for column in parsed]
+
+    # other stop types or a changed file invalidate the cache
+    assert randomTrips.read_stops(stops, ["busStop"], cache=True)[1].tolist() == ["b0", "b1", "b2"]
+    write('    <busStop id="b3" lane="5/5_5/6_0" startPos="50" endPos="70"/>\n')
+    assert randomTrips.read_stops(stops, ["busStop"], cache=True)[1].tolist() == ["b0", "b1", "b2", "b3"]
+    write()
+
+    table = randomTrips.get_edge_table(randomTrips.get_options(["-n", grid]))
+    index = randomTrips.StopIndex(table, parsed, ["busStop"])
+    assert index.counts.sum() == 3 and index.counts[table.index["0/0_1/0"]] == 2
+    assert {index.draw("0/0_1/0") for _ in range(100)} == {' busStop="b0"', ' busStop="b1"'}
+
+    # each stop is drawn by the weight of its edge
+    out = str(tmp_path / "trips.xml")
+    randomTrips.main(randomTrips.get_options(["-n", grid, "-o", out, "-e", "3000", "--seed", "2", "-a", stops,
+                                              "--from-stops", "busStop", "--to-stops", "parkingArea",
+                                              "--stops-cache"]))
+    with open(out) as f:
+        trips = re.findall(r'<trip [^>]*busStop="(\w+)" parkingArea="(\w+)"', f.read())
+    assert len(trips) == 3000
+    counts = Counter(b for b, _ in trips)
+    assert set(counts) == {"b0", "b1", "b2"}
+    assert all(abs(n - 1000) < 100 for n in counts.values())
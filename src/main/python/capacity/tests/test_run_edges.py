@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+if "SUMO_HOME" not in os.environ:
+    pytest.skip("run_edges needs SUMO_HOME", allow_module_level=True)
+
+import subprocess  # noqa
+from argparse import Namespace  # noqa
+from os.path import join  # noqa
+
+import sumolib  # noqa
+import traci  # noqa
+
+from run_edges import search_scales, writeRouteFile, writeDetectorFile, read_result, sumoBinary  # noqa
+from utils import simulate, write_scenario  # noqa
+
+
+def counted(flow):
+    """ evaluate function which records the evaluated scales """
+    calls = []
+
+    def evaluate(k):
+        calls.append(k)
+        return flow(k)
+
+    return evaluate, calls
+
+
+GRID = range(100, 206, 5)
+
+
+def test_search_finds_unimodal_peak():
+    evaluate, calls = counted(lambda k: -abs(k - 135))
+    scales = search_scales(evaluate, patience=2)
+
+    assert 135 in scales
+    assert len(calls) == len(set(calls))
+    assert scales == sorted(calls)
+    # coarse sweep: best at 140, then two scales without improvement
+    assert [k for k in calls if k % 20 == 0] == [100, 120, 140, 160, 180]
+    assert len(calls) < len(GRID) / 2
+
+
+def test_search_on_plateau():
+    flow = lambda k: min(k, 150)  # noqa
+    evaluate, calls = counted(flow)
+    scales = search_scales(evaluate, patience=2)
+
+    assert max(flow(k) for k in scales) == max(flow(k) for k in GRID)
+    assert len(calls) == len(set(calls))
+    # 160 improves, 180 and 200 do not
+    assert [k for k in calls if k % 20 == 0] == [100, 120, 140, 160, 180, 200]
+
+
+@pytest.mark.parametrize("patience", [1, 3])
+def test_patience(patience):
+    evaluate, calls = counted(lambda k: -k)
+    search_scales(evaluate, patience=patience)
+
+    assert [k for k in calls if k % 20 == 0] == [100 + 20 * i for i in range(patience + 1)]
+
+
+def test_search_respects_bounds():
+    evaluate, calls = counted(lambda k: -k)
+    scales = search_scales(evaluate, patience=2)
+    assert min(scales) == 100 and 105 in scales
+
+    evaluate, calls = counted(lambda k: k)
+    scales = search_scales(evaluate, patience=2)
+    assert max(scales) == 205
+    assert len(calls) == len(set(calls))
+
+    evaluate, calls = counted(lambda k: -abs(k - 150))
+    scales = search_scales(evaluate, patience=2, lower=120, upper=160)
+    assert min(scales) >= 120 and max(scales) <= 160 and 150 in scales
+
+
+def simulate_edge(folder, mode, load=False):
+    """ Simulate the flow over edge A0A1 of a small grid with the given mode and return the detector results """
+    os.makedirs(folder)
+    subprocess.check_call([sumolib.checkBinary("netgenerate"), "--grid", "--grid.number", "3",
+                           "--grid.length", "200", "--default.lanenumber", "2", "-o", join(folder, "net.net.xml")])
+    writeRouteFile(join(folder, "route.rou.xml"), "best", "current", "A0A1", 2000, "base")
+    writeDetectorFile(join(folder, "detector.add.xml"), "detector", "A0A1", 2, "1.00")
+    os.makedirs(join(folder, "detector", "1.00"))
+    write_scenario(join(folder, "scenario.sumocfg"), "net.net.xml", "route.rou.xml", "detector.add.xml")
+
+    args = Namespace(sumo_mode=mode, port=sumolib.miscutils.getFreeSocketPort(), step_length=0.2)
+    cmd = ["-c", join(folder, "scenario.sumocfg"), "--scale", "1.00"]
+    if load:
+        traci.start([sumoBinary, "-n", join(folder, "net.net.xml")], port=args.port)
+        try:
+            simulate(sumoBinary, cmd, 600, args, load=True)
+        finally:
+            traci.close()
+    else:
+        simulate(sumoBinary, cmd, 600, args)
+
+    return sorted(read_result(join(folder, "detector", "1.00"), "A0A1", "1.00"), key=lambda r: r["laneId"])
+
+
+def test_sumo_modes_give_same_detector_results(tmp_path):
+    expected = simulate_edge(str(tmp_path / "subprocess"), "subprocess")
+    assert len(expected) == 2
+    assert sum(r["count"] for r in expected) > 100
+
+    assert simulate_edge(str(tmp_path / "traci"), "traci") == expected
+    assert simulate_edge(str(tmp_path / "step"), "step") == expected
+    assert simulate_edge(str(tmp_path / "load"), "traci", load=True) == expected
+
+
+def test_failing_sumo_raises(tmp_path):
+    args = Namespace(sumo_mode="subprocess", port=sumolib.miscutils.getFreeSocketPort(), step_length=0.2)
+    with pytest.raises(subprocess.CalledProcessError):
+        simulate(sumoBinary, ["-c", str(tmp_path / "missing.sumocfg")], 600, args)
+
+    args.sumo_mode = "traci"
+    with pytest.raises(traci.exceptions.FatalTraCIError):
+        simulate(sumoBinary, ["-c", str(tmp_path / "missing.sumocfg")], 600, args)
@@ -0,0 +1,179 @@
+import csv
+import os
+import signal
+import sys
+from argparse import Namespace
+
+import pandas as pd
+import pytest
+
+from utils import MANIFEST, init_workload, run_items, run_netconvert
+
+
+def runner_args(tmp_path, total, index, workers=0):
+    return Namespace(from_index=0, to_index=-1, runner_total=total, runner_index=index, workers=workers,
+                     runner=str(tmp_path / ("runner%d" % index)), output=str(tmp_path), manifest=None,
+                     resume=False, retry_failed=False)
+
+
+def processed(tmp_path):
+    with open(str(tmp_path / MANIFEST), newline="") as f:
+        return [row["id"] for row in csv.DictReader(f) if row["status"] == "done"]
+
+
+@pytest.mark.parametrize("n", [0, 1, 3, 7, 20])
+@pytest.mark.parametrize("total", [1, 2, 3, 8])
+def test_runner_slices_cover_all_items(tmp_path, n, total):
+    items = ["item%d" % i for i in range(n)]
+
+    for index in range(total):
+        args = runner_args(tmp_path, total, index)
+        init_workload(args, items)
+        run_items(args, items, str, lambda a, item: item + ".csv")
+
+    assert sorted(processed(tmp_path)) == sorted(items)
+
+
+def test_killed_worker_marks_items_failed(tmp_path):
+    items = ["item%d" % i for i in range(10)]
+    args = runner_args(tmp_path, 1, 0, workers=2)
+    init_workload(args, items)
+
+    def process(a, item):
+        if item == "item3":
+            os.kill(os.getpid(), signal.SIGKILL)
+        return item + ".csv"
+
+    with pytest.raises(SystemExit) as e:
+        run_items(args, items, str, process)
+    assert e.value.code
+
+    with open(str(tmp_path / MANIFEST), newline="") as f:
+        status = {row["id"]: row["status"] for row in csv.DictReader(f)}
+
+    assert status["item3"] == "failed"
+    assert sorted(status) == sorted(items)
+    assert all(s == "done" for item, s in status.items() if item != "item3")
+
+
+def test_workers_process_every_item_once(tmp_path):
+    items = ["item%d" % i for i in range(25)]
+
+    for index in range(2):
+        args = runner_args(tmp_path, 2, index, workers=3)
+        init_workload(args, items)
+        run_items(args, items, str, lambda a, item: item + ".csv")
+
+    assert sorted(processed(tmp_path)) == sorted(items)
+
+
+def run_once(tmp_path, items, fail=(), **kwargs):
+    """ Runs all items and returns the processed ones """
+    args = runner_args(tmp_path, 1, 0)
+    vars(args).update(kwargs)
+    calls = []
+
+    def process(a, item):
+        calls.append(item)
+        if item in fail:
+            raise ValueError(item)
+        return item + ".csv"
+
+    run_items(args, items, str, process)
+    return calls
+
+
+def test_resume_skips_done_items(tmp_path):
+    items = ["a", "b", "c"]
+    assert run_once(tmp_path, items, fail={"b"}) == items
+
+    assert run_once(tmp_path, items, resume=True) == ["b"]
+    assert run_once(tmp_path, items, resume=True) == []
+    assert run_once(tmp_path, items) == items
+
+
+def test_retry_failed_only_reruns_failed_items(tmp_path):
+    items = ["a", "b", "c"]
+    run_once(tmp_path, items, fail={"b", "c"})
+
+    assert run_once(tmp_path, items, fail={"c"}, retry_failed=True) == ["b", "c"]
+    assert run_once(tmp_path, items, retry_failed=True) == ["c"]
+    assert run_once(tmp_path, items, retry_failed=True) == []
+
+
+def test_partial_manifest_line_is_ignored(tmp_path):
+    items = ["a", "b", "c"]
+    run_once(tmp_path, items[:2])
+
+    # killed while writing the entry of c
+    with open(str(tmp_path / MANIFEST), "a") as f:
+        f.write("c,done,1.0,c.c")
+
+    assert run_once(tmp_path, items, resume=True) == ["c"]
+    assert run_once(tmp_path, items, resume=True) == []
+    with open(str(tmp_path / MANIFEST)) as f:
+        assert f.read().splitlines()[-1] == "c,done,0.0,c.csv"
+
+
+def test_features_skip_manifests(tmp_path):
+    from features import read_edges
+
+    pd.DataFrame({"edgeId": ["e", "e"], "laneId": ["lane_0", "lane_1"], "flow": [1800., 2000.],
+                  "scale": [1., 1.], "count": [10, 11]}).to_csv(str(tmp_path / "e.csv"), index=False)
+
+    items = ["e"]
+    run_once(tmp_path, items)
+    run_once(tmp_path, items, manifest=str(tmp_path / "other.csv"))
+
+    df = read_edges(str(tmp_path))
+    assert df.edgeId.tolist() == ["e"]
+    assert df.capacity.tolist() == [1900.]
+
+
+def test_netconvert_cache(tmp_path):
+    # Stands in for netconvert, logs its calls and writes the arguments into the output
+    netconvert = tmp_path / "netconvert"
+    netconvert.write_text("#!%s\n"
+                          "import sys\n"
+                          "args = sys.argv[1:]\n"
+                          "open(%r, 'a').write(' '.join(args) + '\\n')\n"
+                          "if 'fail' in args:\n"
+                          "    sys.exit(1)\n"
+                          "open(args[-1], 'w').write(open(args[1]).read() + ' '.join(args[2:-2]))\n"
+                          % (sys.executable, str(tmp_path / "calls.log")))
+    netconvert.chmod(0o755)
+
+    def calls():
+        log = tmp_path / "calls.log"
+        return len(log.read_text().splitlines()) if log.exists() else 0
+
+    net = tmp_path / "net.net.xml"
+    net.write_text("net")
+    cache = str(tmp_path / "cache")
+    out = str(tmp_path / "out.net.xml")
+
+    run_netconvert(str(netconvert), str(net), ["--a", "1"], out, cache)
+    assert calls() == 1
+    assert open(out).read() == "net--a 1"
+    assert len(os.listdir(cache)) == 1
+
+    os.remove(out)
+    run_netconvert(str(netconvert), str(net), ["--a", "1"], out, cache)
+    assert calls() == 1
+    assert open(out).read() == "net--a 1"
+
+    # other arguments or another network are different keys
+    run_netconvert(str(netconvert), str(net), ["--a", "2"], out, cache)
+    assert calls() == 2
+    assert open(out).read() == "net--a 2"
+
+    net.write_text("changed net")
+    run_netconvert(str(netconvert), str(net), ["--a", "1"], out, cache)
+    assert calls() == 3
+    assert open(out).read() == "changed net--a 1"
+
+    # failures are not cached, without cache netconvert always runs
+    run_netconvert(str(netconvert), str(net), ["fail"], out, cache)
+    run_netconvert(str(netconvert), str(net), ["--a", "1"], out)
+    assert calls() == 5
+    assert len(os.listdir(cache)) == 3
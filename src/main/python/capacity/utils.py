@@ -1,14 +1,28 @@
 #!/usr/bin/env python
 
 import argparse
+import csv
+import hashlib
+import io
+import multiprocessing
 import os
+import shutil
 import sys
-from subprocess import call
+import time
+from copy import copy
+from os.path import join, basename
+from subprocess import call, check_call
+from traceback import print_exc
 
 from shapely import wkt
 from shapely.ops import transform
 
-def create_args(description):
+# File name of the default manifest within the output folder
+MANIFEST = "manifest.csv"
+
+
+def create_args(description, add_arguments=None):
+    """ Parse the arguments shared by all runners, add_arguments(parser) may add the ones of a single runner """
     import sumolib
 
     parser = argparse.ArgumentParser(description=description)
@@ -24,9 +38,25 @@ def create_args(description):
     parser.add_argument("--from-index", type=int, default=0, help="Start from number")
     parser.add_argument("--to-index", type=int, default=-1, help="Stop at number")
     parser.add_argument("--step-length", type=float, default=0.2, help="SUMO step length")
+    parser.add_argument("--sumo-mode", type=str, default="traci", choices=["traci", "step", "subprocess"],
+                        help="Run SUMO via TraCI advancing to the end in one call, via TraCI step by step, "
+                             "or as plain subprocess without TraCI")
     parser.add_argument("--runner", type=str, default="runner0", help="Runner name")
     parser.add_argument("--runner-total", type=int, default=0, help="Total number of runners")
     parser.add_argument("--runner-index", type=int, default=0, help="Runner index")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Number of worker processes pulling items from a shared queue, "
+                             "each with its own runner directory and port (0 runs sequentially)")
+    parser.add_argument("--net-cache", type=str, default=None,
+                        help="Folder to cache the filtered networks, which are reused across scenarios and reruns")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="Path to the manifest of processed items (default: manifest.csv in the output folder)")
+    parser.add_argument("--resume", action="store_true", help="Skip items which are completed in the manifest")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Only process items whose last run failed according to the manifest")
+
+    if add_arguments:
+        add_arguments(parser)
 
     args = parser.parse_args()
     args.port = sumolib.miscutils.getFreeSocketPort()
@@ -74,15 +104,182 @@ def vehicle_parameter(scenario):
 
 
 def init_workload(args, items):
-    """ Set indices for the runner automatically """
+    """ Set indices for the runner automatically, the slices of all runners together cover all items """
     if args.runner_total <= 1:
         return
 
     n = len(items)
-    step = n // args.runner_total
 
-    args.from_index = args.runner_index * step
-    args.to_index = min((args.runner_index + 1) * step, n)
+    args.from_index = args.runner_index * n // args.runner_total
+    args.to_index = (args.runner_index + 1) * n // args.runner_total
+
+    # an empty slice must not be mistaken for "until the end"
+    if args.to_index == args.from_index:
+        args.from_index = args.to_index = n
+
+
+class Manifest:
+    """ Append-only csv of processed items with id, status (done or failed), duration in seconds and output path.
+     Later entries of an item override earlier ones. """
+
+    COLUMNS = ["id", "status", "duration", "output"]
+
+    def __init__(self, path):
+        self.path = path
+        self.status = {}
+
+        if os.path.exists(path):
+            with open(path, newline="") as f:
+                content = f.read()
+
+            # A trailing line without line break was only written partially, e.g. because the process was killed
+            if not content.endswith("\n"):
+                content = content[:content.rfind("\n") + 1]
+                with open(path, "a", newline="") as f:
+                    f.write("\n")
+
+            for row in csv.DictReader(io.StringIO(content)):
+                self.status[row["id"]] = row["status"]
+        else:
+            with open(path, "w", newline="") as f:
+                csv.writer(f, lineterminator="\n").writerow(self.COLUMNS)
+
+    @classmethod
+    def is_manifest(cls, path):
+        """ Whether the csv file is a manifest, which may be written into the output folder under any name """
+        with open(path, newline="") as f:
+            return f.readline().rstrip("\r\n") == ",".join(cls.COLUMNS)
+
+    def record(self, item, status, duration, output):
+        line = io.StringIO()
+        csv.writer(line, lineterminator="\n").writerow([item, status, "%.1f" % duration, output])
+
+        # A single short write per line, so that concurrent workers can append to the same file
+        with open(self.path, "a", newline="") as f:
+            f.write(line.getvalue())
+
+    def run(self, item, process):
+        """ Call process, which returns the output path, and record the outcome """
+        t = time.time()
+        try:
+            output = process()
+        except Exception:
+            print_exc()
+            self.record(item, "failed", time.time() - t, "")
+        else:
+            self.record(item, "done", time.time() - t, output)
+
+
+def run_items(args, items, item_id, process):
+    """ Process the items of the runner slice sequentially or with args.workers processes.
+     process(args, item) returns the output path, each item is recorded in the manifest. """
+
+    if args.to_index <= 0:
+        args.to_index = len(items)
+
+    manifest = Manifest(args.manifest or join(args.output, MANIFEST))
+
+    indices = range(args.from_index, args.to_index)
+    if args.retry_failed:
+        indices = [i for i in indices if manifest.status.get(item_id(items[i])) == "failed"]
+    elif args.resume:
+        indices = [i for i in indices if manifest.status.get(item_id(items[i])) != "done"]
+
+    print("Skipping %d items according to the manifest" % (args.to_index - args.from_index - len(indices)))
+
+    def task(a, i):
+        manifest.run(item_id(items[i]), lambda: process(a, items[i]))
+
+    if args.workers > 0:
+        lost, exit_ok = run_workers(args, indices, task)
+
+        # Items of workers that died, e.g. killed by the OOM killer, have not been recorded by themselves
+        for i in lost:
+            manifest.record(item_id(items[i]), "failed", 0, "")
+
+        if lost or not exit_ok:
+            sys.exit("Workers exited abnormally, %d items were not finished" % len(lost))
+
+        return
+
+    for n, i in enumerate(indices):
+        task(args, i)
+
+        print("####################################################################")
+        print("[" + str(n + 1) + " / " + str(len(indices)) + "]")
+        sys.stdout.flush()
+
+
+def run_workers(args, indices, process):
+    """ Process the items with the given indices using args.workers processes, which pull the next index from a shared
+     queue when they are done. process(args, index) is called with a copy of args with own runner directory and port.
+     Returns the indices that were not finished and whether all workers exited successfully. """
+
+    import sumolib
+
+    ctx = multiprocessing.get_context("fork")
+
+    # The queue holds positions in indices, which are flagged in finished by the workers
+    queue = ctx.Queue()
+    for pos in range(len(indices)):
+        queue.put(pos)
+
+    # One stop marker per worker
+    for _ in range(args.workers):
+        queue.put(None)
+
+    ports = set()
+    while len(ports) < args.workers:
+        ports.add(sumolib.miscutils.getFreeSocketPort())
+
+    done = ctx.Value("i", 0)
+    finished = ctx.Array("b", len(indices), lock=False)
+
+    workers = [ctx.Process(target=_worker, args=(args, k, port, queue, done, finished, indices, process))
+               for k, port in enumerate(sorted(ports))]
+
+    for w in workers:
+        w.start()
+
+    exit_ok = True
+    for k, w in enumerate(workers):
+        w.join()
+        if w.exitcode != 0:
+            print("Worker %d exited with code %s" % (k, w.exitcode), file=sys.stderr)
+            exit_ok = False
+
+    lost = [i for pos, i in enumerate(indices) if not finished[pos]]
+    if lost:
+        # Positions left in the queue must not block the exit of this process
+        queue.cancel_join_thread()
+
+    return lost, exit_ok
+
+
+def _worker(args, k, port, queue, done, finished, indices, process):
+    args = copy(args)
+    args.runner = join(args.runner, "worker%d" % k)
+    args.port = port
+
+    os.makedirs(args.runner, exist_ok=True)
+
+    while True:
+        pos = queue.get()
+        if pos is None:
+            break
+
+        try:
+            process(args, indices[pos])
+        except Exception:
+            print_exc()
+
+        finished[pos] = 1
+        with done.get_lock():
+            done.value += 1
+            n = done.value
+
+        print("[" + str(n) + " / " + str(len(indices)) + "] (worker %d)" % k)
+        sys.stdout.flush()
 
 
 def init_env():
@@ -95,6 +292,34 @@ def init_env():
     print("Process id:", os.getpid())
 
 
+def simulate(sumo_binary, cmd, end, args, load=False):
+    """ Run SUMO with the arguments cmd until end (in seconds) as given by args.sumo_mode.
+     With load, the scenario is loaded into the already started TraCI connection instead of starting SUMO.
+     Failures of SUMO are raised, so that they are recorded in the manifest. """
+
+    if args.sumo_mode == "subprocess":
+        check_call([sumo_binary] + cmd)
+        return
+
+    import traci
+
+    if load:
+        traci.load(cmd)
+    else:
+        traci.start([sumo_binary] + cmd, port=args.port)
+
+    try:
+        if args.sumo_mode == "step":
+            for step in range(0, int(end * (1 / args.step_length))):
+                traci.simulationStep()
+        else:
+            # A single round trip instead of one per step
+            traci.simulationStep(end)
+    finally:
+        if not load:
+            traci.close()
+
+
 def write_scenario(f, network_file, route_file, additional_file, step_length=0.2, time=600):
     """ Write sumo scenario file """
 
@@ -117,7 +342,49 @@ def write_scenario(f, network_file, route_file, additional_file, step_length=0.2
 """ % (network_file, route_file, additional_file, time, step_length))
 
 
-def filter_network(netconvert, netfile, edge, output, args=None):
+# Content hashes of the source networks, by path, modification time and size
+_file_hashes = {}
+
+
+def file_hash(path):
+    """ Content hash of a file, computed only once per process as long as the file is unchanged """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    if key not in _file_hashes:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _file_hashes[key] = h.hexdigest()
+
+    return _file_hashes[key]
+
+
+def run_netconvert(netconvert, netfile, args, output, cache=None):
+    """ Run netconvert on netfile with the given args. If a cache folder is given, the result is stored there under
+     a key of source network content and args, and reused instead of calling netconvert again. """
+
+    if cache:
+        key = hashlib.sha1("\n".join([file_hash(netfile), basename(netconvert)] + args).encode("utf8")).hexdigest()
+        cached = join(cache, key + ".net.xml")
+
+        if os.path.exists(cached):
+            shutil.copyfile(cached, output)
+            return
+
+    code = call([netconvert, '-s', netfile] + args + ['-o', output])
+
+    if cache and code == 0 and os.path.exists(output):
+        os.makedirs(cache, exist_ok=True)
+
+        # Copy to a temporary file first because other runners may read the cache concurrently
+        tmp = "%s.%d.tmp" % (cached, os.getpid())
+        shutil.copyfile(output, tmp)
+        os.replace(tmp, cached)
+
+
+def filter_network(netconvert, netfile, edge, output, args=None, cache=None):
     if isinstance(edge, list):
         x = [s[0] for e in edge for s in e.getShape()]
         y = [s[1] for e in edge for s in e.getShape()]
@@ -128,17 +395,15 @@ def filter_network(netconvert, netfile, edge, output, args=None):
     # minX,minY,maxX,maxY
     boundary = ",".join(str(s) for s in [min(x) - 50, min(y) - 50, max(x) + 50, max(y) + 50])
 
-    cmd = [netconvert, '-s', netfile, "--keep-edges.in-boundary", boundary]
+    cmd = ["--keep-edges.in-boundary", boundary]
 
     if args:
         cmd += args
 
-    cmd += ['-o', output]
-
-    call(cmd)
+    run_netconvert(netconvert, netfile, cmd, output, cache)
 
 
-def filter_network_polygon(netconvert, netfile, location_offset, geometry, output):
+def filter_network_polygon(netconvert, netfile, location_offset, geometry, output, cache=None):
     """ Filter network with a list of polygon coordinates"""
 
     polygon = wkt.loads(geometry)
@@ -147,7 +412,6 @@ def filter_network_polygon(netconvert, netfile, location_offset, geometry, outpu
 
     coords = ",".join("%.2f,%.2f" % f for f in polygon.exterior.coords)
 
-    cmd = [netconvert, '-s', netfile, "--keep-edges.in-boundary", coords, "--no-internal-links", "false"]
-    cmd += ['-o', output]
+    cmd = ["--keep-edges.in-boundary", coords, "--no-internal-links", "false"]
 
-    call(cmd)
\ No newline at end of file
+    run_netconvert(netconvert, netfile, cmd, output, cache)
\ No newline at end of file